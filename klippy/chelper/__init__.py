@@ -17,11 +17,12 @@ COMPILE_CMD = ("gcc -Wall -g -O2 -shared -fPIC"
 SOURCE_FILES = [
     'pyhelper.c', 'serialqueue.c', 'stepcompress.c', 'itersolve.c',
     'kin_cartesian.c', 'kin_corexy.c', 'kin_markforged.c', 'kin_delta.c', 'kin_polar.c',
-    'kin_winch.c', 'kin_extruder.c',
+    'kin_winch.c', 'kin_extruder.c', 'lookahead.c', 'threadpool.c',
 ]
 DEST_LIB = "c_helper.so"
 OTHER_FILES = [
-    'list.h', 'serialqueue.h', 'stepcompress.h', 'itersolve.h', 'pyhelper.h'
+    'list.h', 'serialqueue.h', 'stepcompress.h', 'itersolve.h', 'pyhelper.h',
+    'threadpool.h',
 ]
 
 defs_stepcompress = """
@@ -29,10 +30,14 @@ defs_stepcompress = """
     void stepcompress_fill(struct stepcompress *sc, uint32_t max_error
         , uint32_t invert_sdir, uint32_t queue_step_msgid
         , uint32_t set_next_step_dir_msgid);
+    void stepcompress_set_delta_msgid(struct stepcompress *sc
+        , uint32_t queue_step_delta_msgid);
     void stepcompress_free(struct stepcompress *sc);
     int stepcompress_reset(struct stepcompress *sc, uint64_t last_step_clock);
     int stepcompress_set_homing(struct stepcompress *sc, uint64_t homing_clock);
     int stepcompress_queue_msg(struct stepcompress *sc, uint32_t *data, int len);
+    void stepcompress_get_stats(struct stepcompress *sc, char *buf, int len);
+    uint32_t stepcompress_get_queue_max(struct stepcompress *sc);
 
     struct steppersync *steppersync_alloc(struct serialqueue *sq
         , struct stepcompress **sc_list, int sc_num, int move_num);
@@ -40,6 +45,8 @@ defs_stepcompress = """
     void steppersync_set_time(struct steppersync *ss
         , double time_offset, double mcu_freq);
     int steppersync_flush(struct steppersync *ss, uint64_t move_clock);
+    int steppersync_flush_multi(struct steppersync **ss_list
+        , uint64_t *move_clocks, int ss_num);
 """
 
 defs_itersolve = """
@@ -50,6 +57,12 @@ defs_itersolve = """
         , double axes_d_x, double axes_d_y, double axes_d_z
         , double start_v, double cruise_v, double accel);
     int32_t itersolve_gen_steps(struct stepper_kinematics *sk, struct move *m);
+    int32_t itersolve_gen_steps_range(struct stepper_kinematics *sk
+        , struct move **moves, int move_count);
+    int32_t itersolve_gen_steps_batch(struct stepper_kinematics **sk_list
+        , int sk_num, struct move **moves, int move_count);
+    int32_t itersolve_gen_steps_multi(struct stepper_kinematics **sk_list
+        , int sk_num, struct move *m);
     void itersolve_set_stepcompress(struct stepper_kinematics *sk
         , struct stepcompress *sc, double step_dist);
     double itersolve_calc_position_from_coord(struct stepper_kinematics *sk
@@ -58,6 +71,32 @@ defs_itersolve = """
     double itersolve_get_commanded_pos(struct stepper_kinematics *sk);
 """
 
+defs_lookahead = """
+    struct lookahead_move {
+        double axes_d_x, axes_d_y, axes_d_z, axes_d_e, move_d, accel;
+        double extrude_r;
+        int is_kinematic_move;
+        double max_start_v2, max_cruise_v2, delta_v2;
+        double max_smoothed_v2, smooth_delta_v2;
+        double start_v2, cruise_v2, end_v2;
+        double pass_end_v2, pass_smoothed_v2;
+        int pass_flags;
+    };
+
+    struct lookahead *lookahead_alloc(void);
+    void lookahead_free(struct lookahead *la);
+    void lookahead_reset(struct lookahead *la);
+    struct lookahead_move *lookahead_add(struct lookahead *la
+        , double axes_d_x, double axes_d_y, double axes_d_z
+        , double axes_d_e, double move_d, double accel
+        , double extrude_r, int is_kinematic_move
+        , double max_cruise_v2, double delta_v2
+        , double smooth_delta_v2, double junction_deviation);
+    struct lookahead_move *lookahead_get_moves(struct lookahead *la);
+    void lookahead_pop(struct lookahead *la, int count);
+    int lookahead_flush(struct lookahead *la, int leftover, int lazy);
+"""
+
 defs_kin_cartesian = """
     struct stepper_kinematics *cartesian_stepper_alloc(char axis);
 """
@@ -94,12 +133,16 @@ defs_kin_extruder = """
 
 defs_serialqueue = """
     #define MESSAGE_MAX 64
+    #define MESSAGE_MAX_ARGS 16
     struct pull_queue_message {
         uint8_t msg[MESSAGE_MAX];
         int len;
         double sent_time, receive_time;
+        int num_args;
+        int64_t args[MESSAGE_MAX_ARGS];
     };
 
+    uint16_t crc16_ccitt(uint8_t *buf, int len);
     struct serialqueue *serialqueue_alloc(int serial_fd, int write_only);
     void serialqueue_exit(struct serialqueue *sq);
     void serialqueue_free(struct serialqueue *sq);
@@ -109,6 +152,8 @@ defs_serialqueue = """
         , uint8_t *msg, int len, uint64_t min_clock, uint64_t req_clock);
     void serialqueue_pull(struct serialqueue *sq
         , struct pull_queue_message *pqm);
+    void serialqueue_set_msg_format(struct serialqueue *sq, int msgid
+        , char *param_types);
     void serialqueue_set_baud_adjust(struct serialqueue *sq, double baud_adjust);
     void serialqueue_set_receive_window(struct serialqueue *sq
         , int receive_window);
@@ -131,7 +176,7 @@ defs_std = """
 defs_all = [
     defs_pyhelper, defs_serialqueue, defs_std, defs_stepcompress, defs_itersolve,
     defs_kin_cartesian, defs_kin_corexy, defs_kin_markforged, defs_kin_delta, defs_kin_polar,
-    defs_kin_winch, defs_kin_extruder
+    defs_kin_winch, defs_kin_extruder, defs_lookahead
 ]
 
 # Return the list of file modification times
@@ -160,7 +205,13 @@ FFI_main = None
 FFI_lib = None
 pyhelper_logging_callback = None
 
-# Return the Foreign Function Interface api to the caller
+# Return the Foreign Function Interface api to the caller.  Note that
+# cffi releases the Python GIL for the duration of every call into
+# c_helper.so, so other host threads (eg, the serial reader and the
+# logging thread) continue to run while long C functions (such as
+# itersolve_gen_steps() and steppersync_flush()) execute.  The C code
+# must not access Python objects - it may only call back into Python
+# via the logging callback (which reacquires the GIL).
 def get_ffi():
     global FFI_main, FFI_lib, pyhelper_logging_callback
     if FFI_lib is None:
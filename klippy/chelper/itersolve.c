@@ -11,6 +11,7 @@
 #include "itersolve.h" // struct coord
 #include "pyhelper.h" // errorf
 #include "stepcompress.h" // queue_append_start
+#include "threadpool.h" // threadpool_run
 
 
 /****************************************************************
@@ -82,6 +83,31 @@ move_get_distance(struct move *m, double move_time)
     return m->decel_start_d + move_eval_accel(&m->decel, move_time);
 }
 
+// Find the time needed to travel a distance during accel/decel
+static inline double
+move_eval_accel_time(struct move_accel *ma, double move_dist)
+{
+    if (move_dist <= 0.)
+        return 0.;
+    double disc = ma->c1*ma->c1 + 4. * ma->c2 * move_dist;
+    return 2. * move_dist / (ma->c1 + (disc > 0. ? sqrt(disc) : 0.));
+}
+
+// Return the time in a move that a given distance is reached
+inline double
+move_get_time(struct move *m, double move_dist)
+{
+    if (unlikely(move_dist < m->cruise_start_d))
+        // Acceleration phase of move
+        return move_eval_accel_time(&m->accel, move_dist);
+    if (likely(move_dist < m->decel_start_d))
+        // Cruising phase
+        return m->accel_t + (move_dist - m->cruise_start_d) / m->cruise_v;
+    // Deceleration phase
+    return m->accel_t + m->cruise_t + move_eval_accel_time(
+        &m->decel, move_dist - m->decel_start_d);
+}
+
 // Return the XYZ coordinates given a time in a move
 inline struct coord
 move_get_coord(struct move *m, double move_time)
@@ -139,10 +165,136 @@ itersolve_find_step(struct stepper_kinematics *sk, struct move *m
     return best_guess;
 }
 
+
+
+/****************************************************************
+ * Direct step time solver
+ ****************************************************************/
+
+// The position of some steppers (eg, cartesian and extruder steppers)
+// is a linear function of the distance moved.  Each phase of the
+// move then has a quadratic position formula and the step times can
+// be found by solving that quadratic directly.
+
+// Find the time (relative to 'start_pos') that a phase with initial
+// velocity 'v' and half acceleration 'h' reaches the 'target'
+// position while moving in the direction 'dir'
+static inline double
+linear_find_step(double start_pos, double v, double h, double target, int dir)
+{
+    double delta = target - start_pos;
+    if (dir ? delta <= 0. : delta >= 0.)
+        return 0.;
+    if (!h)
+        return delta / v;
+    // Solve h*t^2 + v*t - delta = 0 (using a form that avoids
+    // cancellation as 'v' always has the sign of 'dir')
+    double disc = v*v + 4. * h * delta;
+    double sqrt_disc = disc > 0. ? sqrt(disc) : 0.;
+    return 2. * delta / (v + (dir ? sqrt_disc : -sqrt_disc));
+}
+
+// Generate steps for a portion of a phase where the stepper moves in
+// only one direction
+static int
+linear_gen_steps(struct queue_append *qa, struct stepper_kinematics *sk
+                 , double mcu_freq, int *psdir, double *plast_pos
+                 , double start_time, double end_time
+                 , double start_pos, double end_pos, double v, double h)
+{
+    double half_step = .5 * sk->step_dist;
+    int dir = end_pos > start_pos, sdir = *psdir;
+    double last_pos = *plast_pos;
+    for (;;) {
+        double target = last_pos + (dir ? half_step : -half_step);
+        if (unlikely(dir != sdir)) {
+            // Only change direction if going past midway point
+            if (dir ? end_pos < target + .000000001
+                : end_pos > target - .000000001)
+                break;
+            int ret = queue_append_set_next_step_dir(qa, dir);
+            if (ret)
+                return ret;
+            sdir = dir;
+        } else if (dir ? end_pos < target : end_pos > target) {
+            break;
+        }
+        double step_time = start_time + linear_find_step(
+            start_pos, v, h, target, dir);
+        if (step_time > end_time)
+            step_time = end_time;
+        int ret = queue_append(qa, step_time * mcu_freq);
+        if (ret)
+            return ret;
+        last_pos = target + (dir ? half_step : -half_step);
+    }
+    *psdir = sdir;
+    *plast_pos = last_pos;
+    return 0;
+}
+
+// Generate step times for a stepper with a calc_linear() callback
+static int32_t
+itersolve_gen_steps_linear(struct stepper_kinematics *sk, struct move *m)
+{
+    struct linear_pos lp = sk->calc_linear(sk, m);
+    if (!lp.ratio)
+        return 0;
+    struct stepcompress *sc = sk->sc;
+    double mcu_freq = stepcompress_get_mcu_freq(sc);
+    double last_pos = sk->commanded_pos;
+    int sdir = stepcompress_get_step_dir(sc);
+    struct queue_append qa = queue_append_start(sc, m->print_time, .5);
+    // Phase start time, duration, start distance, velocity, half accel
+    double phases[3][5] = {
+        { 0., m->accel_t, 0., m->accel.c1, m->accel.c2 },
+        { m->accel_t, m->cruise_t, m->cruise_start_d, m->cruise_v, 0. },
+        { m->accel_t + m->cruise_t, m->move_t - m->accel_t - m->cruise_t
+          , m->decel_start_d, m->decel.c1, m->decel.c2 } };
+    int i;
+    for (i = 0; i < 3; i++) {
+        double *ph = phases[i], phase_t = ph[1];
+        if (phase_t <= 0.)
+            continue;
+        double start_time = ph[0];
+        double start_pos = lp.base + lp.ratio * ph[2];
+        double v = lp.ratio * ph[3], h = lp.ratio * ph[4];
+        // Split the phase where the stepper changes direction
+        double mid_t = h ? -v / (2. * h) : 0.;
+        if (mid_t > 0. && mid_t < phase_t) {
+            double mid_pos = start_pos + (v + h * mid_t) * mid_t;
+            int ret = linear_gen_steps(
+                &qa, sk, mcu_freq, &sdir, &last_pos, start_time
+                , start_time + mid_t, start_pos, mid_pos, v, h);
+            if (ret)
+                return ret;
+            start_time += mid_t;
+            phase_t -= mid_t;
+            start_pos = mid_pos;
+            v = 0.;
+        }
+        double end_pos = start_pos + (v + h * phase_t) * phase_t;
+        if (end_pos == start_pos)
+            continue;
+        int ret = linear_gen_steps(
+            &qa, sk, mcu_freq, &sdir, &last_pos, start_time
+            , start_time + phase_t, start_pos, end_pos, v, h);
+        if (ret)
+            return ret;
+    }
+    queue_append_finish(qa);
+    sk->commanded_pos = last_pos;
+    return 0;
+}
+
 // Generate step times for a stepper during a move
 int32_t __visible
 itersolve_gen_steps(struct stepper_kinematics *sk, struct move *m)
 {
+    if (sk->gen_steps)
+        return sk->gen_steps(sk, m);
+    if (sk->calc_linear)
+        return itersolve_gen_steps_linear(sk, m);
     struct stepcompress *sc = sk->sc;
     sk_callback calc_position = sk->calc_position;
     double half_step = .5 * sk->step_dist;
@@ -207,6 +359,106 @@ itersolve_gen_steps(struct stepper_kinematics *sk, struct move *m)
     return 0;
 }
 
+
+// Check if a stepper may move during a given move
+static inline int
+check_active(struct stepper_kinematics *sk, struct move *m)
+{
+    int af = sk->active_flags;
+    return (!af || ((af & AF_X) && m->axes_r.x) || ((af & AF_Y) && m->axes_r.y)
+            || ((af & AF_Z) && m->axes_r.z));
+}
+
+// Generate step times for a stepper during a list of moves
+int32_t __visible
+itersolve_gen_steps_range(struct stepper_kinematics *sk, struct move **moves
+                          , int move_count)
+{
+    int i;
+    for (i = 0; i < move_count; i++) {
+        struct move *m = moves[i];
+        if (!check_active(sk, m))
+            continue;
+        int32_t ret = itersolve_gen_steps(sk, m);
+        if (ret)
+            return ret;
+    }
+    return 0;
+}
+
+
+/****************************************************************
+ * Parallel step generation
+ ****************************************************************/
+
+// Each stepper has its own stepcompress queue, so the steps for
+// several steppers may be generated concurrently.  Handing a job to
+// the worker threads has a fixed cost, so small jobs are processed
+// directly.
+#define PARALLEL_MIN_STEPS 2000
+
+// Check if the steps for a job should be generated by the thread pool.
+// The number of steps is estimated from the toolhead distance of each
+// move (an active stepper is assumed to travel a similar distance) so
+// that no kinematic calculations are needed.
+static int
+stepgen_use_pool(struct stepper_kinematics **sk_list, int sk_num
+                 , struct move **moves, int move_count)
+{
+    if (sk_num < 2 || !threadpool_is_available())
+        return 0;
+    double steps = 0.;
+    int i, j;
+    for (i = 0; i < move_count && steps < PARALLEL_MIN_STEPS; i++) {
+        struct move *m = moves[i];
+        double move_d = move_get_distance(m, m->move_t);
+        for (j = 0; j < sk_num; j++)
+            if (check_active(sk_list[j], m))
+                steps += move_d / sk_list[j]->step_dist;
+    }
+    return steps >= PARALLEL_MIN_STEPS;
+}
+
+struct stepgen_job {
+    struct stepper_kinematics **sk_list;
+    struct move **moves;
+    int move_count;
+};
+
+static int32_t
+stepgen_job_run(void *data, int index)
+{
+    struct stepgen_job *job = data;
+    return itersolve_gen_steps_range(job->sk_list[index], job->moves
+                                     , job->move_count);
+}
+
+// Generate step times for several steppers during a list of moves
+int32_t __visible
+itersolve_gen_steps_batch(struct stepper_kinematics **sk_list, int sk_num
+                          , struct move **moves, int move_count)
+{
+    if (stepgen_use_pool(sk_list, sk_num, moves, move_count)) {
+        struct stepgen_job job = { sk_list, moves, move_count };
+        return threadpool_run(stepgen_job_run, &job, sk_num);
+    }
+    int i;
+    for (i = 0; i < sk_num; i++) {
+        int32_t ret = itersolve_gen_steps_range(sk_list[i], moves, move_count);
+        if (ret)
+            return ret;
+    }
+    return 0;
+}
+
+// Generate step times for several steppers during a move
+int32_t __visible
+itersolve_gen_steps_multi(struct stepper_kinematics **sk_list, int sk_num
+                          , struct move *m)
+{
+    return itersolve_gen_steps_batch(sk_list, sk_num, &m, 1);
+}
+
 void __visible
 itersolve_set_stepcompress(struct stepper_kinematics *sk
                            , struct stepcompress *sc, double step_dist)
@@ -27,18 +27,43 @@ void move_fill(struct move *m, double print_time
                , double axes_d_x, double axes_d_y, double axes_d_z
                , double start_v, double cruise_v, double accel);
 double move_get_distance(struct move *m, double move_time);
+double move_get_time(struct move *m, double move_dist);
 struct coord move_get_coord(struct move *m, double move_time);
 
 struct stepper_kinematics;
 typedef double (*sk_callback)(struct stepper_kinematics *sk, struct move *m
                               , double move_time);
+// Stepper position described as: base + ratio * move_get_distance()
+struct linear_pos {
+    double base, ratio;
+};
+typedef struct linear_pos (*sk_linear_callback)(
+    struct stepper_kinematics *sk, struct move *m);
+typedef int32_t (*sk_gen_callback)(struct stepper_kinematics *sk
+                                   , struct move *m);
+// Flags indicating which move axes may change a stepper's position
+// (a stepper with no flags set is processed for every move)
+enum { AF_X = 1 << 0, AF_Y = 1 << 1, AF_Z = 1 << 2 };
+
 struct stepper_kinematics {
     double step_dist, commanded_pos;
     struct stepcompress *sc;
     sk_callback calc_position;
+    // Optional - allows step times to be calculated directly
+    sk_linear_callback calc_linear;
+    // Optional - kinematic specific step time generation
+    sk_gen_callback gen_steps;
+    int active_flags;
 };
 
 int32_t itersolve_gen_steps(struct stepper_kinematics *sk, struct move *m);
+int32_t itersolve_gen_steps_range(struct stepper_kinematics *sk
+                                  , struct move **moves, int move_count);
+int32_t itersolve_gen_steps_batch(struct stepper_kinematics **sk_list
+                                  , int sk_num, struct move **moves
+                                  , int move_count);
+int32_t itersolve_gen_steps_multi(struct stepper_kinematics **sk_list
+                                  , int sk_num, struct move *m);
 void itersolve_set_stepcompress(struct stepper_kinematics *sk
                                 , struct stepcompress *sc, double step_dist);
 double itersolve_calc_position_from_coord(struct stepper_kinematics *sk
@@ -17,6 +17,12 @@ cart_stepper_x_calc_position(struct stepper_kinematics *sk, struct move *m
     return move_get_coord(m, move_time).x;
 }
 
+static struct linear_pos
+cart_stepper_x_calc_linear(struct stepper_kinematics *sk, struct move *m)
+{
+    return (struct linear_pos){ m->start_pos.x, m->axes_r.x };
+}
+
 static double
 cart_stepper_y_calc_position(struct stepper_kinematics *sk, struct move *m
                              , double move_time)
@@ -24,6 +30,12 @@ cart_stepper_y_calc_position(struct stepper_kinematics *sk, struct move *m
     return move_get_coord(m, move_time).y;
 }
 
+static struct linear_pos
+cart_stepper_y_calc_linear(struct stepper_kinematics *sk, struct move *m)
+{
+    return (struct linear_pos){ m->start_pos.y, m->axes_r.y };
+}
+
 static double
 cart_stepper_z_calc_position(struct stepper_kinematics *sk, struct move *m
                              , double move_time)
@@ -31,16 +43,29 @@ cart_stepper_z_calc_position(struct stepper_kinematics *sk, struct move *m
     return move_get_coord(m, move_time).z;
 }
 
+static struct linear_pos
+cart_stepper_z_calc_linear(struct stepper_kinematics *sk, struct move *m)
+{
+    return (struct linear_pos){ m->start_pos.z, m->axes_r.z };
+}
+
 struct stepper_kinematics * __visible
 cartesian_stepper_alloc(char axis)
 {
     struct stepper_kinematics *sk = malloc(sizeof(*sk));
     memset(sk, 0, sizeof(*sk));
-    if (axis == 'x')
+    if (axis == 'x') {
         sk->calc_position = cart_stepper_x_calc_position;
-    else if (axis == 'y')
+        sk->calc_linear = cart_stepper_x_calc_linear;
+        sk->active_flags = AF_X;
+    } else if (axis == 'y') {
         sk->calc_position = cart_stepper_y_calc_position;
-    else if (axis == 'z')
+        sk->calc_linear = cart_stepper_y_calc_linear;
+        sk->active_flags = AF_Y;
+    } else if (axis == 'z') {
         sk->calc_position = cart_stepper_z_calc_position;
+        sk->calc_linear = cart_stepper_z_calc_linear;
+        sk->active_flags = AF_Z;
+    }
     return sk;
 }
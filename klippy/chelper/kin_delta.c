@@ -10,6 +10,7 @@
 #include <string.h> // memset
 #include "compiler.h" // __visible
 #include "itersolve.h" // struct stepper_kinematics
+#include "stepcompress.h" // queue_append
 
 struct delta_stepper {
     struct stepper_kinematics sk;
@@ -26,6 +27,135 @@ delta_stepper_calc_position(struct stepper_kinematics *sk, struct move *m
     return sqrt(ds->arm2 - dx*dx - dy*dy) + c.z;
 }
 
+
+/****************************************************************
+ * Direct step time solver
+ ****************************************************************/
+
+// Along a move the carriage position is a concave function of the
+// distance travelled:
+//   pos(d) = z0 + rz*d + sqrt(k + 2*c*d - u*d*d)
+// The carriage therefore changes direction at most once during a
+// move, and the distance where the carriage reaches a given position
+// can be found directly (it is where the move's line intersects a
+// sphere of radius 'arm' centered on the carriage).
+struct delta_line {
+    double z0, rz, c, u, k;
+};
+
+static inline double
+delta_line_position(struct delta_line *dl, double move_dist)
+{
+    return (dl->z0 + dl->rz * move_dist
+            + sqrt(dl->k + (2. * dl->c - dl->u * move_dist) * move_dist));
+}
+
+// Return the move distance with the highest carriage position
+static double
+delta_line_peak(struct delta_line *dl)
+{
+    if (!dl->u)
+        // Vertical move
+        return dl->rz > 0. ? INFINITY : -INFINITY;
+    double s = sqrt(dl->u * dl->k + dl->c * dl->c);
+    // Use a form that avoids cancellation
+    if ((dl->rz >= 0.) == (dl->c >= 0.))
+        return (dl->c + dl->rz * s) / dl->u;
+    return (dl->c * dl->c - dl->rz * dl->rz * dl->k) / (dl->c - dl->rz * s);
+}
+
+// Return the move distance (before the peak if 'rising', otherwise
+// after the peak) where the carriage reaches 'pos'
+static inline double
+delta_line_find_dist(struct delta_line *dl, double pos, int rising)
+{
+    double q = pos - dl->z0, b = dl->c + q * dl->rz;
+    double disc = b*b - q*q + dl->k;
+    double sqrt_disc = disc > 0. ? sqrt(disc) : 0.;
+    return rising ? b - sqrt_disc : b + sqrt_disc;
+}
+
+// Generate steps for a portion of a move where the carriage moves in
+// only one direction
+static int
+delta_gen_steps_range(struct queue_append *qa, struct stepper_kinematics *sk
+                      , struct move *m, struct delta_line *dl
+                      , double mcu_freq, int *psdir, double *plast_pos
+                      , double start_dist, double end_dist, int rising)
+{
+    double start_pos = delta_line_position(dl, start_dist);
+    double end_pos = delta_line_position(dl, end_dist);
+    if (end_pos == start_pos)
+        return 0;
+    double half_step = .5 * sk->step_dist;
+    int dir = end_pos > start_pos, sdir = *psdir;
+    double last_pos = *plast_pos;
+    for (;;) {
+        double target = last_pos + (dir ? half_step : -half_step);
+        if (unlikely(dir != sdir)) {
+            // Only change direction if going past midway point
+            if (dir ? end_pos < target + .000000001
+                : end_pos > target - .000000001)
+                break;
+            int ret = queue_append_set_next_step_dir(qa, dir);
+            if (ret)
+                return ret;
+            sdir = dir;
+        } else if (dir ? end_pos < target : end_pos > target) {
+            break;
+        }
+        double move_dist = delta_line_find_dist(dl, target, rising);
+        if (move_dist < start_dist)
+            move_dist = start_dist;
+        else if (move_dist > end_dist)
+            move_dist = end_dist;
+        int ret = queue_append(qa, move_get_time(m, move_dist) * mcu_freq);
+        if (ret)
+            return ret;
+        last_pos = target + (dir ? half_step : -half_step);
+    }
+    *psdir = sdir;
+    *plast_pos = last_pos;
+    return 0;
+}
+
+// Generate step times for a delta tower during a move
+static int32_t
+delta_stepper_gen_steps(struct stepper_kinematics *sk, struct move *m)
+{
+    struct delta_stepper *ds = container_of(sk, struct delta_stepper, sk);
+    double dx = ds->tower_x - m->start_pos.x;
+    double dy = ds->tower_y - m->start_pos.y;
+    double rx = m->axes_r.x, ry = m->axes_r.y;
+    struct delta_line dl = {
+        .z0 = m->start_pos.z, .rz = m->axes_r.z, .c = rx*dx + ry*dy,
+        .u = rx*rx + ry*ry, .k = ds->arm2 - dx*dx - dy*dy };
+    double move_d = move_get_distance(m, m->move_t);
+    double peak_d = delta_line_peak(&dl);
+    struct stepcompress *sc = sk->sc;
+    double mcu_freq = stepcompress_get_mcu_freq(sc);
+    double last_pos = sk->commanded_pos;
+    int sdir = stepcompress_get_step_dir(sc);
+    struct queue_append qa = queue_append_start(sc, m->print_time, .5);
+    if (peak_d > 0.) {
+        int ret = delta_gen_steps_range(
+            &qa, sk, m, &dl, mcu_freq, &sdir, &last_pos
+            , 0., peak_d < move_d ? peak_d : move_d, 1);
+        if (ret)
+            return ret;
+    }
+    if (peak_d < move_d) {
+        int ret = delta_gen_steps_range(
+            &qa, sk, m, &dl, mcu_freq, &sdir, &last_pos
+            , peak_d > 0. ? peak_d : 0., move_d, 0);
+        if (ret)
+            return ret;
+    }
+    queue_append_finish(qa);
+    sk->commanded_pos = last_pos;
+    return 0;
+}
+
 struct stepper_kinematics * __visible
 delta_stepper_alloc(double arm2, double tower_x, double tower_y)
 {
@@ -35,5 +165,7 @@ delta_stepper_alloc(double arm2, double tower_x, double tower_y)
     ds->tower_x = tower_x;
     ds->tower_y = tower_y;
     ds->sk.calc_position = delta_stepper_calc_position;
+    ds->sk.gen_steps = delta_stepper_gen_steps;
+    ds->sk.active_flags = AF_X | AF_Y | AF_Z;
     return &ds->sk;
 }
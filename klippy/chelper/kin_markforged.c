@@ -51,6 +51,13 @@ markforged_stepper_a_calc_position(struct stepper_kinematics *sk, struct move *m
     return c.x + c.y;
 }
 
+static struct linear_pos
+markforged_stepper_a_calc_linear(struct stepper_kinematics *sk, struct move *m)
+{
+    return (struct linear_pos){ m->start_pos.x + m->start_pos.y
+                                , m->axes_r.x + m->axes_r.y };
+}
+
 static double
 markforged_stepper_b_calc_position(struct stepper_kinematics *sk, struct move *m
                              , double move_time)
@@ -58,14 +65,25 @@ markforged_stepper_b_calc_position(struct stepper_kinematics *sk, struct move *m
     return move_get_coord(m, move_time).y;
 }
 
+static struct linear_pos
+markforged_stepper_b_calc_linear(struct stepper_kinematics *sk, struct move *m)
+{
+    return (struct linear_pos){ m->start_pos.y, m->axes_r.y };
+}
+
 struct stepper_kinematics * __visible
 markforged_stepper_alloc(char axis)
 {
     struct stepper_kinematics *sk = malloc(sizeof(*sk));
     memset(sk, 0, sizeof(*sk));
-    if (axis == 'a')
+    if (axis == 'a') {
         sk->calc_position = markforged_stepper_a_calc_position;
-    else if (axis == 'b')
+        sk->calc_linear = markforged_stepper_a_calc_linear;
+        sk->active_flags = AF_X | AF_Y;
+    } else if (axis == 'b') {
         sk->calc_position = markforged_stepper_b_calc_position;
+        sk->calc_linear = markforged_stepper_b_calc_linear;
+        sk->active_flags = AF_Y;
+    }
     return sk;
 }
@@ -37,5 +37,6 @@ polar_stepper_alloc(char type)
         sk->calc_position = polar_stepper_radius_calc_position;
     else if (type == 'a')
         sk->calc_position = polar_stepper_angle_calc_position;
+    sk->active_flags = AF_X | AF_Y;
     return sk;
 }
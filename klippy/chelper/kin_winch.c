@@ -36,5 +36,6 @@ winch_stepper_alloc(double anchor_x, double anchor_y, double anchor_z)
     hs->anchor.y = anchor_y;
     hs->anchor.z = anchor_z;
     hs->sk.calc_position = winch_stepper_calc_position;
+    hs->sk.active_flags = AF_X | AF_Y | AF_Z;
     return &hs->sk;
 }
@@ -0,0 +1,284 @@
+// Move queue "look-ahead" junction speed planning
+//
+// Copyright (C) 2016-2018  Kevin O'Connor <kevin@koconnor.net>
+//
+// This file may be distributed under the terms of the GNU GPLv3 license.
+//
+// The toolhead queues moves and then periodically traverses the
+// queue from last to first move to determine the maximum junction
+// speed between moves (assuming the robot comes to a complete stop
+// after the last move).  The queue can hold thousands of small
+// moves, so the per-move planning state is kept here in a compact
+// array and the junction and traversal calculations are done in C.
+//
+// A lazy flush only needs to traverse the queue until it reaches a
+// move where the traversal state matches the state recorded by the
+// previous traversal - the remaining moves are unaffected by the
+// moves queued since then.  This keeps the cost of lazy flushing
+// proportional to the number of newly queued moves.
+
+#include <math.h> // sqrt
+#include <stdlib.h> // malloc
+#include <string.h> // memset
+#include "compiler.h" // __visible
+#include "pyhelper.h" // errorf
+
+#define LOOKAHEAD_START_SIZE 1024
+#define EXTRUDE_DIFF_IGNORE 1.02
+
+struct lookahead_move {
+    // Move parameters
+    double axes_d_x, axes_d_y, axes_d_z, axes_d_e, move_d, accel;
+    double extrude_r;
+    int is_kinematic_move;
+    // Limits (in velocity squared) set when the move is queued
+    double max_start_v2, max_cruise_v2, delta_v2;
+    double max_smoothed_v2, smooth_delta_v2;
+    // Junction speeds determined by lookahead_flush()
+    double start_v2, cruise_v2, end_v2;
+    // Traversal state on reaching this move during the last lazy flush
+    double pass_end_v2, pass_smoothed_v2;
+    int pass_flags;
+};
+
+enum { LP_VALID=1<<0, LP_PEAK=1<<1, LP_DELAYED=1<<2 };
+
+struct lookahead {
+    struct lookahead_move *moves;
+    int count, size;
+};
+
+static inline double
+min2(double a, double b)
+{
+    return b < a ? b : a;
+}
+
+// Determine the maximum extruder velocity (squared) at the junction
+// between two moves
+static double
+extruder_calc_junction(struct lookahead_move *prev_move
+                       , struct lookahead_move *m)
+{
+    double extrude = m->axes_d_e, prev_extrude = prev_move->axes_d_e;
+    if (extrude || prev_extrude) {
+        if (!extrude || !prev_extrude)
+            // Extrude move to non-extrude move - disable lookahead
+            return 0.;
+        if ((m->extrude_r > prev_move->extrude_r * EXTRUDE_DIFF_IGNORE
+             || prev_move->extrude_r > m->extrude_r * EXTRUDE_DIFF_IGNORE)
+            && fabs(m->move_d * prev_move->extrude_r - extrude) >= .001)
+            // Extrude ratio between moves is too different
+            return 0.;
+        m->extrude_r = prev_move->extrude_r;
+    }
+    return m->max_cruise_v2;
+}
+
+// Determine the maximum velocity (squared) at the start of a move
+static void
+calc_junction(struct lookahead_move *prev_move, struct lookahead_move *m
+              , double junction_deviation)
+{
+    if (!m->is_kinematic_move || !prev_move->is_kinematic_move)
+        return;
+    // Allow extruder to calculate its maximum junction
+    double extruder_v2 = extruder_calc_junction(prev_move, m);
+    // Find max velocity using approximated centripetal velocity as
+    // described at:
+    // https://onehossshay.wordpress.com/2011/09/24/improving_grbl_cornering_algorithm/
+    double junction_cos_theta = -((m->axes_d_x * prev_move->axes_d_x
+                                   + m->axes_d_y * prev_move->axes_d_y
+                                   + m->axes_d_z * prev_move->axes_d_z)
+                                  / (m->move_d * prev_move->move_d));
+    if (junction_cos_theta > 0.999999)
+        return;
+    if (-0.999999 > junction_cos_theta)
+        junction_cos_theta = -0.999999;
+    double sin_theta_d2 = sqrt(0.5*(1.0-junction_cos_theta));
+    double R = junction_deviation * sin_theta_d2 / (1. - sin_theta_d2);
+    double tan_theta_d2 = sin_theta_d2 / sqrt(0.5*(1.0+junction_cos_theta));
+    double move_centripetal_v2 = .5 * m->move_d * tan_theta_d2 * m->accel;
+    double prev_move_centripetal_v2 = (.5 * prev_move->move_d * tan_theta_d2
+                                       * prev_move->accel);
+    double max_start_v2 = min2(R * m->accel, R * prev_move->accel);
+    max_start_v2 = min2(max_start_v2, move_centripetal_v2);
+    max_start_v2 = min2(max_start_v2, prev_move_centripetal_v2);
+    max_start_v2 = min2(max_start_v2, extruder_v2);
+    max_start_v2 = min2(max_start_v2, m->max_cruise_v2);
+    max_start_v2 = min2(max_start_v2, prev_move->max_cruise_v2);
+    max_start_v2 = min2(max_start_v2, (prev_move->max_start_v2
+                                       + prev_move->delta_v2));
+    m->max_start_v2 = max_start_v2;
+    m->max_smoothed_v2 = min2(
+        max_start_v2, prev_move->max_smoothed_v2 + prev_move->smooth_delta_v2);
+}
+
+struct lookahead * __visible
+lookahead_alloc(void)
+{
+    struct lookahead *la = malloc(sizeof(*la));
+    memset(la, 0, sizeof(*la));
+    la->size = LOOKAHEAD_START_SIZE;
+    la->moves = malloc(la->size * sizeof(*la->moves));
+    return la;
+}
+
+void __visible
+lookahead_free(struct lookahead *la)
+{
+    if (!la)
+        return;
+    free(la->moves);
+    free(la);
+}
+
+// Remove all moves from the queue
+void __visible
+lookahead_reset(struct lookahead *la)
+{
+    la->count = 0;
+}
+
+// Add a move to the end of the queue and calculate its maximum
+// junction speed with the previous move in the queue.  Returns the
+// new queue entry (or NULL on an allocation failure).
+struct lookahead_move * __visible
+lookahead_add(struct lookahead *la
+              , double axes_d_x, double axes_d_y, double axes_d_z
+              , double axes_d_e, double move_d, double accel
+              , double extrude_r, int is_kinematic_move
+              , double max_cruise_v2, double delta_v2
+              , double smooth_delta_v2, double junction_deviation)
+{
+    if (la->count >= la->size) {
+        int new_size = la->size * 2;
+        struct lookahead_move *new_moves = realloc(
+            la->moves, new_size * sizeof(*la->moves));
+        if (!new_moves) {
+            errorf("lookahead_add realloc failed");
+            return NULL;
+        }
+        la->moves = new_moves;
+        la->size = new_size;
+    }
+    struct lookahead_move *m = &la->moves[la->count++];
+    memset(m, 0, sizeof(*m));
+    m->axes_d_x = axes_d_x;
+    m->axes_d_y = axes_d_y;
+    m->axes_d_z = axes_d_z;
+    m->axes_d_e = axes_d_e;
+    m->move_d = move_d;
+    m->accel = accel;
+    m->extrude_r = extrude_r;
+    m->is_kinematic_move = is_kinematic_move;
+    m->max_cruise_v2 = max_cruise_v2;
+    m->delta_v2 = delta_v2;
+    m->smooth_delta_v2 = smooth_delta_v2;
+    if (la->count > 1)
+        calc_junction(m - 1, m, junction_deviation);
+    return m;
+}
+
+// Return the array of queued moves (valid until the next add or pop)
+struct lookahead_move * __visible
+lookahead_get_moves(struct lookahead *la)
+{
+    return la->moves;
+}
+
+// Remove the first 'count' moves from the queue
+void __visible
+lookahead_pop(struct lookahead *la, int count)
+{
+    if (count >= la->count) {
+        la->count = 0;
+        return;
+    }
+    la->count -= count;
+    memmove(la->moves, &la->moves[count], la->count * sizeof(*la->moves));
+}
+
+// Determine the junction speeds of the moves from 'leftover' to the
+// end of the queue.  Returns the number of moves with final junction
+// speeds (the start_v2, cruise_v2, and end_v2 fields of each move
+// from 'leftover' up to that count are updated), or -1 if 'lazy' is
+// set and no additional moves could be finalized.
+int __visible
+lookahead_flush(struct lookahead *la, int leftover, int lazy)
+{
+    struct lookahead_move *moves = la->moves;
+    int update_flush_count = lazy;
+    int flush_count = la->count;
+    // Delayed moves are always the 'delayed' moves directly after the
+    // move being processed.  Their start_v2/end_v2 fields temporarily
+    // hold the values needed to finalize them.
+    int delayed = 0, i;
+    double next_end_v2 = 0., next_smoothed_v2 = 0., peak_cruise_v2 = 0.;
+    for (i = flush_count - 1; i >= leftover; i--) {
+        struct lookahead_move *m = &moves[i];
+        if (update_flush_count) {
+            // Until a flush point is found, the traversal only depends
+            // on these values.  If they are unchanged from the last
+            // traversal then no new moves can be flushed.
+            int flags = (LP_VALID | (peak_cruise_v2 ? LP_PEAK : 0)
+                         | (delayed ? LP_DELAYED : 0));
+            if (m->pass_flags == flags && m->pass_end_v2 == next_end_v2
+                && m->pass_smoothed_v2 == next_smoothed_v2)
+                return -1;
+            m->pass_flags = flags;
+            m->pass_end_v2 = next_end_v2;
+            m->pass_smoothed_v2 = next_smoothed_v2;
+        }
+        double reachable_start_v2 = next_end_v2 + m->delta_v2;
+        double start_v2 = min2(m->max_start_v2, reachable_start_v2);
+        double reachable_smoothed_v2 = next_smoothed_v2 + m->smooth_delta_v2;
+        double smoothed_v2 = min2(m->max_smoothed_v2, reachable_smoothed_v2);
+        if (smoothed_v2 < reachable_smoothed_v2) {
+            // It's possible for this move to accelerate
+            if (smoothed_v2 + m->smooth_delta_v2 > next_smoothed_v2
+                || delayed) {
+                // This move can decelerate or this is a full accel
+                // move after a full decel move
+                if (update_flush_count && peak_cruise_v2) {
+                    flush_count = i;
+                    update_flush_count = 0;
+                }
+                peak_cruise_v2 = min2(m->max_cruise_v2, (
+                    smoothed_v2 + reachable_smoothed_v2) * .5);
+                if (delayed) {
+                    // Propagate peak_cruise_v2 to any delayed moves
+                    if (!update_flush_count && i < flush_count) {
+                        int j;
+                        for (j = i + 1; j <= i + delayed; j++) {
+                            struct lookahead_move *dm = &moves[j];
+                            double mc_v2 = min2(peak_cruise_v2, dm->start_v2);
+                            dm->start_v2 = min2(dm->start_v2, mc_v2);
+                            dm->cruise_v2 = mc_v2;
+                            dm->end_v2 = min2(dm->end_v2, mc_v2);
+                        }
+                    }
+                    delayed = 0;
+                }
+            }
+            if (!update_flush_count && i < flush_count) {
+                double cruise_v2 = min2(min2(
+                    (start_v2 + reachable_start_v2) * .5, m->max_cruise_v2)
+                                        , peak_cruise_v2);
+                m->start_v2 = min2(start_v2, cruise_v2);
+                m->cruise_v2 = cruise_v2;
+                m->end_v2 = min2(next_end_v2, cruise_v2);
+            }
+        } else {
+            // Delay calculating this move until peak_cruise_v2 is known
+            m->start_v2 = start_v2;
+            m->end_v2 = next_end_v2;
+            delayed++;
+        }
+        next_end_v2 = start_v2;
+        next_smoothed_v2 = smoothed_v2;
+    }
+    if (update_flush_count)
+        return -1;
+    return flush_count;
+}
@@ -200,18 +200,43 @@ set_non_blocking(int fd)
  * Serial protocol helpers
  ****************************************************************/
 
+// Lookup tables for the crc "ccitt" algorithm (processing 4 bytes at
+// a time - "slicing-by-4")
+static uint16_t crc16_table[4][256];
+static pthread_once_t crc16_table_once = PTHREAD_ONCE_INIT;
+
+static void
+crc16_table_init(void)
+{
+    int i, j;
+    for (i=0; i<256; i++) {
+        uint8_t data = i;
+        data ^= data << 4;
+        crc16_table[0][i] = (((uint16_t)data << 8) ^ (uint8_t)(data >> 4)
+                             ^ ((uint16_t)data << 3));
+    }
+    for (j=1; j<ARRAY_SIZE(crc16_table); j++)
+        for (i=0; i<256; i++) {
+            uint16_t crc = crc16_table[j-1][i];
+            crc16_table[j][i] = (crc >> 8) ^ crc16_table[0][crc & 0xff];
+        }
+}
+
 // Implement the standard crc "ccitt" algorithm on the given buffer
-static uint16_t
-crc16_ccitt(uint8_t *buf, uint8_t len)
+uint16_t __visible
+crc16_ccitt(uint8_t *buf, int len)
 {
+    pthread_once(&crc16_table_once, crc16_table_init);
     uint16_t crc = 0xffff;
-    while (len--) {
-        uint8_t data = *buf++;
-        data ^= crc & 0xff;
-        data ^= data << 4;
-        crc = ((((uint16_t)data << 8) | (crc >> 8)) ^ (uint8_t)(data >> 4)
-               ^ ((uint16_t)data << 3));
+    while (len >= 4) {
+        uint16_t v = crc ^ (buf[0] | (buf[1] << 8));
+        crc = (crc16_table[3][v & 0xff] ^ crc16_table[2][v >> 8]
+               ^ crc16_table[1][buf[2]] ^ crc16_table[0][buf[3]]);
+        buf += 4;
+        len -= 4;
     }
+    while (len--)
+        crc = (crc >> 8) ^ crc16_table[0][(crc ^ *buf++) & 0xff];
     return crc;
 }
 
@@ -374,6 +399,7 @@ struct serialqueue {
     uint64_t need_kick_clock;
     // Received messages
     struct list_head receive_queue;
+    char *msg_formats[256];
     // Debugging
     struct list_head old_sent, old_receive;
     // Stats
@@ -890,6 +916,9 @@ serialqueue_free(struct serialqueue *sq)
         message_queue_free(&cq->ready_queue);
         message_queue_free(&cq->stalled_queue);
     }
+    int i;
+    for (i=0; i<ARRAY_SIZE(sq->msg_formats); i++)
+        free(sq->msg_formats[i]);
     pthread_mutex_unlock(&sq->lock);
     pollreactor_free(&sq->pr);
     free(sq);
@@ -987,6 +1016,55 @@ serialqueue_encode_and_send(struct serialqueue *sq, struct command_queue *cq
     serialqueue_send_batch(sq, cq, &msgs);
 }
 
+// Register the parameter types ('u' for unsigned and 'i' for signed
+// integers) of a message that may be decoded by serialqueue_pull()
+void __visible
+serialqueue_set_msg_format(struct serialqueue *sq, int msgid
+                           , char *param_types)
+{
+    if (msgid < 0 || msgid >= ARRAY_SIZE(sq->msg_formats)
+        || strlen(param_types) > MESSAGE_MAX_ARGS)
+        return;
+    char *fmt = strdup(param_types);
+    pthread_mutex_lock(&sq->lock);
+    free(sq->msg_formats[msgid]);
+    sq->msg_formats[msgid] = fmt;
+    pthread_mutex_unlock(&sq->lock);
+}
+
+// Decode the integer parameters of a received message
+static void
+decode_message(struct serialqueue *sq, struct pull_queue_message *pqm)
+{
+    pqm->num_args = -1;
+    uint8_t *p = &pqm->msg[MESSAGE_HEADER_SIZE];
+    uint8_t *end = &pqm->msg[pqm->len - MESSAGE_TRAILER_SIZE];
+    if (p >= end)
+        return;
+    char *fmt = sq->msg_formats[*p++];
+    if (!fmt)
+        return;
+    int num_args = 0;
+    while (*fmt) {
+        if (p >= end)
+            return;
+        uint8_t c = *p++;
+        uint32_t v = c & 0x7f;
+        if ((c & 0x60) == 0x60)
+            v |= -0x20;
+        while (c & 0x80) {
+            if (p >= end)
+                return;
+            c = *p++;
+            v = (v<<7) | (c & 0x7f);
+        }
+        pqm->args[num_args++] = *fmt++ == 'i' ? (int64_t)(int32_t)v : v;
+    }
+    if (p != end)
+        return;
+    pqm->num_args = num_args;
+}
+
 // Return a message read from the serial port (or wait for one if none
 // available)
 void __visible
@@ -1014,6 +1092,7 @@ serialqueue_pull(struct serialqueue *sq, struct pull_queue_message *pqm)
     pqm->sent_time = qm->sent_time;
     pqm->receive_time = qm->receive_time;
     debug_queue_add(&sq->old_receive, qm);
+    decode_message(sq, pqm);
 
     pthread_mutex_unlock(&sq->lock);
     return;
@@ -1105,6 +1184,7 @@ serialqueue_extract_old(struct serialqueue *sq, int sentq
             pqm->len = qm->len;
             pqm->sent_time = qm->sent_time;
             pqm->receive_time = qm->receive_time;
+            pqm->num_args = -1;
         }
         list_del(&qm->node);
         message_free(qm);
@@ -18,6 +18,7 @@
 #define MESSAGE_SEQ_MASK 0x0f
 #define MESSAGE_DEST 0x10
 #define MESSAGE_SYNC 0x7E
+#define MESSAGE_MAX_ARGS 16
 
 struct queue_message {
     int len;
@@ -35,6 +36,7 @@ struct queue_message {
     struct list_node node;
 };
 
+uint16_t crc16_ccitt(uint8_t *buf, int len);
 struct queue_message *message_alloc_and_encode(uint32_t *data, int len);
 void message_queue_free(struct list_head *root);
 
@@ -42,6 +44,9 @@ struct pull_queue_message {
     uint8_t msg[MESSAGE_MAX];
     int len;
     double sent_time, receive_time;
+    // Decoded integer parameters (num_args is -1 if not decoded)
+    int num_args;
+    int64_t args[MESSAGE_MAX_ARGS];
 };
 
 struct serialqueue;
@@ -59,6 +64,8 @@ void serialqueue_encode_and_send(struct serialqueue *sq, struct command_queue *c
                                  , uint32_t *data, int len
                                  , uint64_t min_clock, uint64_t req_clock);
 void serialqueue_pull(struct serialqueue *sq, struct pull_queue_message *pqm);
+void serialqueue_set_msg_format(struct serialqueue *sq, int msgid
+                                , char *param_types);
 void serialqueue_set_baud_adjust(struct serialqueue *sq, double baud_adjust);
 void serialqueue_set_clock_est(struct serialqueue *sq, double est_freq
                                , double last_clock_time, uint64_t last_clock);
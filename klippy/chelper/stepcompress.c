@@ -16,20 +16,26 @@
 
 #include <stddef.h> // offsetof
 #include <stdint.h> // uint32_t
-#include <stdio.h> // fprintf
+#include <stdio.h> // snprintf
 #include <stdlib.h> // malloc
 #include <string.h> // memset
 #include "compiler.h" // DIV_ROUND_UP
 #include "pyhelper.h" // errorf
 #include "serialqueue.h" // struct queue_message
+#include "threadpool.h" // threadpool_run
 #include "stepcompress.h" // stepcompress_alloc
 
 #define CHECK_LINES 1
-#define QUEUE_START_SIZE 1024
+// Capacity of the step time ring buffer (must be larger than the
+// 65535 + 2000 steps that may be pending before a forced flush)
+#define QUEUE_SIZE (65536 + 4096)
 
 struct stepcompress {
-    // Buffer management
-    uint32_t *queue, *queue_end, *queue_pos, *queue_next;
+    // Buffer management - the ring buffer storage is 2*QUEUE_SIZE
+    // entries and every entry is written at both 'pos' and
+    // 'pos +/- QUEUE_SIZE' so that the pending step times are always
+    // available as a contiguous array starting at queue_pos.
+    uint32_t *queue, *queue_pos, *queue_next;
     // Internal tracking
     uint32_t max_error;
     double mcu_time_offset, mcu_freq;
@@ -38,6 +44,12 @@ struct stepcompress {
     struct list_head msg_queue;
     uint32_t queue_step_msgid, set_next_step_dir_msgid, oid;
     int sdir, invert_sdir;
+    // queue_step_delta support
+    uint32_t queue_step_delta_msgid, last_interval;
+    int have_delta_msgid, have_last_interval;
+    // Statistics
+    uint32_t stat_steps, stat_queue_steps, stat_queue_step_bytes;
+    uint32_t stat_queue_max;
 };
 
 
@@ -74,6 +86,18 @@ minmax_point(struct stepcompress *sc, uint32_t *pos)
     return (struct points){ point - max_error, point };
 }
 
+// Return the minimum and maximum acceptable times of the step
+// following a step requested at 'prevpoint'
+static inline struct points
+next_minmax_point(struct stepcompress *sc, uint32_t *pos, uint32_t prevpoint)
+{
+    uint32_t point = *pos - (uint32_t)sc->last_step_clock;
+    uint32_t max_error = (point - prevpoint) / 2;
+    if (max_error > sc->max_error)
+        max_error = sc->max_error;
+    return (struct points){ point - max_error, point };
+}
+
 // The maximum add delta between two valid quadratic sequences of the
 // form "add*count*(count-1)/2 + interval*count" is "(6 + 4*sqrt(2)) *
 // maxerror / (count*count)".  The "6 + 4*sqrt(2)" is 11.65685, but
@@ -100,24 +124,38 @@ compress_bisect_add(struct stepcompress *sc)
     int32_t zerointerval = 0, zerocount = 0;
 
     for (;;) {
-        // Find longest valid sequence with the given 'add'
+        // Find longest valid sequence with the given 'add'.  The
+        // reach of the minimum and maximum intervals (and of the 'add'
+        // factor) are updated incrementally to avoid recalculating
+        // them for every point.
         struct points nextpoint;
         int32_t nextmininterval = outer_mininterval;
         int32_t nextmaxinterval = outer_maxinterval, interval = nextmaxinterval;
-        int32_t nextcount = 1;
+        int32_t minreach = nextmininterval, maxreach = nextmaxinterval;
+        int32_t nextcount = 1, addreach = 0;
+        uint32_t prevpoint = point.maxp;
         for (;;) {
+            addreach += add*nextcount;
             nextcount++;
             if (&sc->queue_pos[nextcount-1] >= qlast) {
                 int32_t count = nextcount - 1;
                 return (struct step_move){ interval, count, add };
             }
-            nextpoint = minmax_point(sc, sc->queue_pos + nextcount - 1);
-            int32_t nextaddfactor = nextcount*(nextcount-1)/2;
-            int32_t c = add*nextaddfactor;
-            if (nextmininterval*nextcount < nextpoint.minp - c)
-                nextmininterval = DIV_ROUND_UP(nextpoint.minp - c, nextcount);
-            if (nextmaxinterval*nextcount > nextpoint.maxp - c)
-                nextmaxinterval = (nextpoint.maxp - c) / nextcount;
+            nextpoint = next_minmax_point(sc, sc->queue_pos + nextcount - 1
+                                          , prevpoint);
+            prevpoint = nextpoint.maxp;
+            int32_t minp = nextpoint.minp - addreach;
+            int32_t maxp = nextpoint.maxp - addreach;
+            minreach += nextmininterval;
+            maxreach += nextmaxinterval;
+            if (minreach < minp) {
+                nextmininterval = DIV_ROUND_UP(minp, nextcount);
+                minreach = nextmininterval*nextcount;
+            }
+            if (maxreach > maxp) {
+                nextmaxinterval = maxp / nextcount;
+                maxreach = nextmaxinterval*nextcount;
+            }
             if (nextmininterval > nextmaxinterval)
                 break;
             interval = nextmaxinterval;
@@ -232,6 +270,8 @@ stepcompress_alloc(uint32_t oid)
 {
     struct stepcompress *sc = malloc(sizeof(*sc));
     memset(sc, 0, sizeof(*sc));
+    sc->queue = malloc(2 * QUEUE_SIZE * sizeof(*sc->queue));
+    sc->queue_pos = sc->queue_next = sc->queue;
     list_init(&sc->msg_queue);
     sc->oid = oid;
     sc->sdir = -1;
@@ -250,6 +290,15 @@ stepcompress_fill(struct stepcompress *sc, uint32_t max_error
     sc->set_next_step_dir_msgid = set_next_step_dir_msgid;
 }
 
+// Enable the queue_step_delta command
+void __visible
+stepcompress_set_delta_msgid(struct stepcompress *sc
+                             , uint32_t queue_step_delta_msgid)
+{
+    sc->queue_step_delta_msgid = queue_step_delta_msgid;
+    sc->have_delta_msgid = 1;
+}
+
 // Free memory associated with a 'stepcompress' object
 void __visible
 stepcompress_free(struct stepcompress *sc)
@@ -261,22 +310,59 @@ stepcompress_free(struct stepcompress *sc)
     free(sc);
 }
 
+// Return the number of bytes needed to encode an integer parameter
+static int
+encoded_int_size(int32_t v)
+{
+    if (v >= 0xc000000 || v < -0x4000000) return 5;
+    if (v >= 0x180000 || v < -0x80000) return 4;
+    if (v >= 0x3000 || v < -0x1000) return 3;
+    if (v >= 0x60 || v < -0x20) return 2;
+    return 1;
+}
+
+// Create a queue_step command for the given 'step_move'.  If the mcu
+// supports it, the interval is sent relative to the interval of the
+// last step of the previous sequence (queue_step_delta) when that
+// encodes in fewer bytes.
+static struct queue_message *
+queue_step_alloc(struct stepcompress *sc, struct step_move move)
+{
+    uint32_t msg[5] = {
+        sc->queue_step_msgid, sc->oid, move.interval, move.count, move.add
+    };
+    if (sc->have_delta_msgid && sc->have_last_interval) {
+        int32_t delta = move.interval - sc->last_interval;
+        if (encoded_int_size(delta) < encoded_int_size(move.interval)) {
+            msg[0] = sc->queue_step_delta_msgid;
+            msg[2] = delta;
+        }
+    }
+    sc->last_interval = move.interval + (uint32_t)move.add * (move.count - 1);
+    sc->have_last_interval = 1;
+    struct queue_message *qm = message_alloc_and_encode(msg, 5);
+    sc->stat_steps += move.count;
+    sc->stat_queue_steps++;
+    sc->stat_queue_step_bytes += qm->len;
+    return qm;
+}
+
 // Convert previously scheduled steps into commands for the mcu
 static int
 stepcompress_flush(struct stepcompress *sc, uint64_t move_clock)
 {
     if (sc->queue_pos >= sc->queue_next)
         return 0;
+    uint32_t in_use = sc->queue_next - sc->queue_pos;
+    if (in_use > sc->stat_queue_max)
+        sc->stat_queue_max = in_use;
     while (sc->last_step_clock < move_clock) {
         struct step_move move = compress_bisect_add(sc);
         int ret = check_line(sc, move);
         if (ret)
             return ret;
 
-        uint32_t msg[5] = {
-            sc->queue_step_msgid, sc->oid, move.interval, move.count, move.add
-        };
-        struct queue_message *qm = message_alloc_and_encode(msg, 5);
+        struct queue_message *qm = queue_step_alloc(sc, move);
         qm->min_clock = qm->req_clock = sc->last_step_clock;
         int32_t addfactor = move.count*(move.count-1)/2;
         uint32_t ticks = move.add*addfactor + move.interval*move.count;
@@ -291,6 +377,11 @@ stepcompress_flush(struct stepcompress *sc, uint64_t move_clock)
             break;
         }
         sc->queue_pos += move.count;
+        if (sc->queue_pos >= sc->queue + QUEUE_SIZE) {
+            // Continue from the mirror copy in the first half of the buffer
+            sc->queue_pos -= QUEUE_SIZE;
+            sc->queue_next -= QUEUE_SIZE;
+        }
     }
     return 0;
 }
@@ -299,10 +390,8 @@ stepcompress_flush(struct stepcompress *sc, uint64_t move_clock)
 static int
 stepcompress_flush_far(struct stepcompress *sc, uint64_t abs_step_clock)
 {
-    uint32_t msg[5] = {
-        sc->queue_step_msgid, sc->oid, abs_step_clock - sc->last_step_clock, 1, 0
-    };
-    struct queue_message *qm = message_alloc_and_encode(msg, 5);
+    struct step_move move = { abs_step_clock - sc->last_step_clock, 1, 0 };
+    struct queue_message *qm = queue_step_alloc(sc, move);
     qm->min_clock = sc->last_step_clock;
     sc->last_step_clock = qm->req_clock = abs_step_clock;
     if (sc->homing_clock)
@@ -368,6 +457,23 @@ stepcompress_queue_msg(struct stepcompress *sc, uint32_t *data, int len)
     return 0;
 }
 
+// Report the number of steps and queue_step commands generated
+void __visible
+stepcompress_get_stats(struct stepcompress *sc, char *buf, int len)
+{
+    snprintf(buf, len, "steps=%u queue_steps=%u queue_step_bytes=%u"
+             " queue_max=%u"
+             , sc->stat_steps, sc->stat_queue_steps
+             , sc->stat_queue_step_bytes, sc->stat_queue_max);
+}
+
+// Return the maximum number of step times that have been pending
+uint32_t __visible
+stepcompress_get_queue_max(struct stepcompress *sc)
+{
+    return sc->stat_queue_max;
+}
+
 // Set the conversion rate of 'print_time' to mcu clock
 static void
 stepcompress_set_time(struct stepcompress *sc
@@ -403,15 +509,43 @@ stepcompress_get_step_dir(struct stepcompress *sc)
 // Maximium clock delta between messages in the queue
 #define CLOCK_DIFF_MAX (3<<28)
 
+// Store a clock time at the given queue position (and its mirror)
+static inline void
+queue_store(struct stepcompress *sc, uint32_t *qnext, uint32_t step_clock)
+{
+    qnext[0] = step_clock;
+    if (qnext < sc->queue + QUEUE_SIZE)
+        qnext[QUEUE_SIZE] = step_clock;
+    else
+        qnext[-QUEUE_SIZE] = step_clock;
+}
+
+// Update a cursor with the current queue position
+static inline void
+queue_append_load(struct queue_append *qa)
+{
+    struct stepcompress *sc = qa->sc;
+    uint32_t *qmid = sc->queue + QUEUE_SIZE, *qlimit = sc->queue_pos+QUEUE_SIZE;
+    qa->qnext = sc->queue_next;
+    if (qa->qnext < qmid) {
+        qa->qend = qlimit < qmid ? qlimit : qmid;
+        qa->qmirror = QUEUE_SIZE;
+    } else {
+        qa->qend = qlimit;
+        qa->qmirror = -QUEUE_SIZE;
+    }
+}
+
 // Create a cursor for inserting clock times into the queue
 inline struct queue_append
 queue_append_start(struct stepcompress *sc, double print_time, double adjust)
 {
     double print_clock = (print_time - sc->mcu_time_offset) * sc->mcu_freq;
-    return (struct queue_append) {
-        .sc = sc, .qnext = sc->queue_next, .qend = sc->queue_end,
-        .last_step_clock_32 = sc->last_step_clock,
+    struct queue_append qa = {
+        .sc = sc, .last_step_clock_32 = sc->last_step_clock,
         .clock_offset = (print_clock - (double)sc->last_step_clock) + adjust };
+    queue_append_load(&qa);
+    return qa;
 }
 
 // Finalize a cursor created with queue_append_start()
@@ -444,27 +578,12 @@ queue_append_slow(struct stepcompress *sc, double rel_sc)
             return ret;
     }
 
-    if (sc->queue_next >= sc->queue_end) {
-        // Make room in the queue
-        int in_use = sc->queue_next - sc->queue_pos;
-        if (sc->queue_pos > sc->queue) {
-            // Shuffle the internal queue to avoid having to allocate more ram
-            memmove(sc->queue, sc->queue_pos, in_use * sizeof(*sc->queue));
-        } else {
-            // Expand the internal queue of step times
-            int alloc = sc->queue_end - sc->queue;
-            if (!alloc)
-                alloc = QUEUE_START_SIZE;
-            while (in_use >= alloc)
-                alloc *= 2;
-            sc->queue = realloc(sc->queue, alloc * sizeof(*sc->queue));
-            sc->queue_end = sc->queue + alloc;
-        }
-        sc->queue_pos = sc->queue;
-        sc->queue_next = sc->queue + in_use;
+    if (sc->queue_next - sc->queue_pos >= QUEUE_SIZE) {
+        errorf("stepcompress o=%d: Step queue overflow", sc->oid);
+        return ERROR_RET;
     }
 
-    *sc->queue_next++ = abs_step_clock;
+    queue_store(sc, sc->queue_next++, abs_step_clock);
     return 0;
 }
 
@@ -474,21 +593,20 @@ queue_append(struct queue_append *qa, double step_clock)
 {
     double rel_sc = step_clock + qa->clock_offset;
     if (likely(!(qa->qnext >= qa->qend || rel_sc >= (double)CLOCK_DIFF_MAX))) {
-        *qa->qnext++ = qa->last_step_clock_32 + (uint32_t)rel_sc;
+        uint32_t abs_step_clock = qa->last_step_clock_32 + (uint32_t)rel_sc;
+        qa->qnext[0] = qa->qnext[qa->qmirror] = abs_step_clock;
+        qa->qnext++;
         return 0;
     }
-    // Call queue_append_slow() to handle queue expansion and integer overflow
+    // Call queue_append_slow() to handle queue wrapping and integer overflow
     struct stepcompress *sc = qa->sc;
     uint64_t old_last_step_clock = sc->last_step_clock;
     sc->queue_next = qa->qnext;
     int ret = queue_append_slow(sc, rel_sc);
-    if (ret)
-        return ret;
-    qa->qnext = sc->queue_next;
-    qa->qend = sc->queue_end;
+    queue_append_load(qa);
     qa->last_step_clock_32 = sc->last_step_clock;
     qa->clock_offset -= sc->last_step_clock - old_last_step_clock;
-    return 0;
+    return ret;
 }
 
 inline int
@@ -498,13 +616,10 @@ queue_append_set_next_step_dir(struct queue_append *qa, int sdir)
     uint64_t old_last_step_clock = sc->last_step_clock;
     sc->queue_next = qa->qnext;
     int ret = set_next_step_dir(sc, sdir);
-    if (ret)
-        return ret;
-    qa->qnext = sc->queue_next;
-    qa->qend = sc->queue_end;
+    queue_append_load(qa);
     qa->last_step_clock_32 = sc->last_step_clock;
     qa->clock_offset -= sc->last_step_clock - old_last_step_clock;
-    return 0;
+    return ret;
 }
 
 
@@ -652,3 +767,46 @@ steppersync_flush(struct steppersync *ss, uint64_t move_clock)
         serialqueue_send_batch(ss->sq, ss->cq, &msgs);
     return 0;
 }
+
+// Flushing the steppersync objects of several mcus may be done
+// concurrently when enough steps are pending.
+#define PARALLEL_FLUSH_MIN_STEPS 2000
+
+struct flush_job {
+    struct steppersync **ss_list;
+    uint64_t *move_clocks;
+};
+
+static int32_t
+flush_job_run(void *data, int index)
+{
+    struct flush_job *job = data;
+    int ret = steppersync_flush(job->ss_list[index], job->move_clocks[index]);
+    return ret ? index + 1 : 0;
+}
+
+// Flush several steppersync objects (each up to its own move_clock).
+// Returns one plus the index of a failing steppersync, or zero.
+int __visible
+steppersync_flush_multi(struct steppersync **ss_list, uint64_t *move_clocks
+                        , int ss_num)
+{
+    struct flush_job job = { ss_list, move_clocks };
+    uint32_t pending = 0;
+    int i, j;
+    for (i=0; i<ss_num && threadpool_is_available(); i++) {
+        struct steppersync *ss = ss_list[i];
+        for (j=0; j<ss->sc_num; j++) {
+            struct stepcompress *sc = ss->sc_list[j];
+            pending += sc->queue_next - sc->queue_pos;
+        }
+    }
+    if (ss_num > 1 && pending >= PARALLEL_FLUSH_MIN_STEPS)
+        return threadpool_run(flush_job_run, &job, ss_num);
+    for (i=0; i<ss_num; i++) {
+        int ret = flush_job_run(&job, i);
+        if (ret)
+            return ret;
+    }
+    return 0;
+}
@@ -9,10 +9,14 @@ struct stepcompress *stepcompress_alloc(uint32_t oid);
 void stepcompress_fill(struct stepcompress *sc, uint32_t max_error
                        , uint32_t invert_sdir, uint32_t queue_step_msgid
                        , uint32_t set_next_step_dir_msgid);
+void stepcompress_set_delta_msgid(struct stepcompress *sc
+                                  , uint32_t queue_step_delta_msgid);
 void stepcompress_free(struct stepcompress *sc);
 int stepcompress_reset(struct stepcompress *sc, uint64_t last_step_clock);
 int stepcompress_set_homing(struct stepcompress *sc, uint64_t homing_clock);
 int stepcompress_queue_msg(struct stepcompress *sc, uint32_t *data, int len);
+void stepcompress_get_stats(struct stepcompress *sc, char *buf, int len);
+uint32_t stepcompress_get_queue_max(struct stepcompress *sc);
 double stepcompress_get_mcu_freq(struct stepcompress *sc);
 uint32_t stepcompress_get_oid(struct stepcompress *sc);
 int stepcompress_get_step_dir(struct stepcompress *sc);
@@ -20,6 +24,7 @@ int stepcompress_get_step_dir(struct stepcompress *sc);
 struct queue_append {
     struct stepcompress *sc;
     uint32_t *qnext, *qend, last_step_clock_32;
+    int qmirror;
     double clock_offset;
 };
 struct queue_append queue_append_start(
@@ -36,5 +41,7 @@ void steppersync_free(struct steppersync *ss);
 void steppersync_set_time(struct steppersync *ss, double time_offset
                           , double mcu_freq);
 int steppersync_flush(struct steppersync *ss, uint64_t move_clock);
+int steppersync_flush_multi(struct steppersync **ss_list
+                            , uint64_t *move_clocks, int ss_num);
 
 #endif // stepcompress.h
@@ -0,0 +1,129 @@
+// Pool of worker threads for processing independent host tasks
+//
+// Copyright (C) 2018  Kevin O'Connor <kevin@koconnor.net>
+//
+// This file may be distributed under the terms of the GNU GPLv3 license.
+//
+// Some host tasks (eg, generating the steps of several steppers or
+// flushing the step queues of several micro-controllers) consist of
+// independent items that may be processed concurrently.  The worker
+// threads are created on first use (one less than the number of
+// processors).
+
+#include <pthread.h> // pthread_create
+#include <stdlib.h> // malloc
+#include <string.h> // memset
+#include <unistd.h> // sysconf
+#include "pyhelper.h" // report_errno
+#include "threadpool.h" // threadpool_run
+
+#define MAX_WORKER_THREADS 7
+
+struct threadpool {
+    pthread_mutex_t lock;
+    pthread_cond_t cond, done_cond;
+    int num_threads;
+    pthread_t threads[MAX_WORKER_THREADS];
+    // Current job
+    threadpool_fn fn;
+    void *data;
+    int count, next, pending, job_seq;
+    int32_t ret;
+};
+
+static struct threadpool *threadpool;
+
+// Process items from the current job until none remain (the pool
+// lock must be held)
+static void
+threadpool_process(struct threadpool *p)
+{
+    while (p->next < p->count) {
+        int index = p->next++;
+        pthread_mutex_unlock(&p->lock);
+        int32_t ret = p->fn(p->data, index);
+        pthread_mutex_lock(&p->lock);
+        if (ret)
+            p->ret = ret;
+        if (!--p->pending)
+            pthread_cond_signal(&p->done_cond);
+    }
+}
+
+static void *
+threadpool_thread(void *data)
+{
+    struct threadpool *p = data;
+    pthread_mutex_lock(&p->lock);
+    int job_seq = p->job_seq;
+    for (;;) {
+        while (job_seq == p->job_seq)
+            pthread_cond_wait(&p->cond, &p->lock);
+        job_seq = p->job_seq;
+        threadpool_process(p);
+    }
+    return NULL;
+}
+
+// Create the worker threads
+static struct threadpool *
+threadpool_alloc(void)
+{
+    struct threadpool *p = malloc(sizeof(*p));
+    memset(p, 0, sizeof(*p));
+    pthread_mutex_init(&p->lock, NULL);
+    pthread_cond_init(&p->cond, NULL);
+    pthread_cond_init(&p->done_cond, NULL);
+    long cpus = sysconf(_SC_NPROCESSORS_ONLN);
+    int count = cpus > MAX_WORKER_THREADS ? MAX_WORKER_THREADS : cpus - 1, i;
+    for (i = 0; i < count; i++) {
+        int ret = pthread_create(&p->threads[i], NULL, threadpool_thread, p);
+        if (ret) {
+            report_errno("pthread_create", ret);
+            break;
+        }
+        p->num_threads++;
+    }
+    return p;
+}
+
+// Return false if it is known that there are no worker threads
+int
+threadpool_is_available(void)
+{
+    return !threadpool || threadpool->num_threads;
+}
+
+// Call fn(data, index) for each index from zero to count-1 using the
+// worker threads (and the calling thread).  Returns the non-zero
+// result of one of the calls if any fail.
+int32_t
+threadpool_run(threadpool_fn fn, void *data, int count)
+{
+    if (!threadpool)
+        threadpool = threadpool_alloc();
+    struct threadpool *p = threadpool;
+    if (!p->num_threads || count < 2) {
+        int i;
+        for (i = 0; i < count; i++) {
+            int32_t ret = fn(data, i);
+            if (ret)
+                return ret;
+        }
+        return 0;
+    }
+    pthread_mutex_lock(&p->lock);
+    p->fn = fn;
+    p->data = data;
+    p->count = p->pending = count;
+    p->next = 0;
+    p->ret = 0;
+    p->job_seq++;
+    pthread_cond_broadcast(&p->cond);
+    threadpool_process(p);
+    while (p->pending)
+        pthread_cond_wait(&p->done_cond, &p->lock);
+    int32_t ret = p->ret;
+    pthread_mutex_unlock(&p->lock);
+    return ret;
+}
@@ -0,0 +1,10 @@
+#ifndef THREADPOOL_H
+#define THREADPOOL_H
+
+#include <stdint.h> // int32_t
+
+typedef int32_t (*threadpool_fn)(void *data, int index);
+int threadpool_is_available(void);
+int32_t threadpool_run(threadpool_fn fn, void *data, int count);
+
+#endif // threadpool.h
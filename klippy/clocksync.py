@@ -3,11 +3,16 @@
 # Copyright (C) 2016-2018  Kevin O'Connor <kevin@koconnor.net>
 #
 # This file may be distributed under the terms of the GNU GPLv3 license.
-import logging, math
+import logging, math, collections
 
 RTT_AGE = .000010 / (60. * 60.)
 DECAY = 1. / 30.
 TRANSMIT_EXTRA = .001
+QUERY_TIME = .9839
+FAST_QUERY_TIME = .0983
+FAST_QUERY_STDDEV = .000500
+FAST_QUERY_MAX = 100
+STATS_HISTORY = 60
 
 class ClockSync:
     def __init__(self, reactor):
@@ -15,7 +20,8 @@ class ClockSync:
         self.serial = None
         self.get_clock_timer = self.reactor.register_timer(self._get_clock_event)
         self.get_clock_cmd = None
-        self.queries_pending = 0
+        self.queries_pending = 0.
+        self.fast_query_count = 0
         self.mcu_freq = 1.
         self.last_clock = 0
         self.clock_est = (0., 0., 0.)
@@ -27,6 +33,10 @@ class ClockSync:
         self.clock_avg = self.clock_covariance = 0.
         self.prediction_variance = 0.
         self.last_prediction_time = 0.
+        self.sample_count = 0
+        # Sync quality tracking
+        self.last_rtt = 0.
+        self.history = collections.deque(maxlen=STATS_HISTORY)
     def connect(self, serial):
         self.serial = serial
         self.mcu_freq = serial.msgparser.get_constant_float('CLOCK_FREQ')
@@ -57,12 +67,20 @@ class ClockSync:
     # MCU clock querying (_handle_clock is invoked from background thread)
     def _get_clock_event(self, eventtime):
         self.get_clock_cmd.send()
-        self.queries_pending += 1
+        # Query more often while the clock prediction is poor
+        query_time = QUERY_TIME
+        if (self.fast_query_count < FAST_QUERY_MAX
+            and self.prediction_variance > (
+                FAST_QUERY_STDDEV * self.mcu_freq)**2):
+            self.fast_query_count += 1
+            query_time = FAST_QUERY_TIME
+        # Track pending queries in units of the regular query time
+        self.queries_pending += query_time / QUERY_TIME
         # Use an unusual time for the next event so clock messages
         # don't resonate with other periodic events.
-        return eventtime + .9839
+        return eventtime + query_time
     def _handle_clock(self, params):
-        self.queries_pending = 0
+        self.queries_pending = 0.
         # Extend clock to 64bit
         last_clock = self.last_clock
         clock = (last_clock & ~0xffffffff) | params['clock']
@@ -75,6 +93,7 @@ class ClockSync:
             return
         receive_time = params['#receive_time']
         half_rtt = .5 * (receive_time - sent_time)
+        self.last_rtt = receive_time - sent_time
         aged_rtt = (sent_time - self.min_rtt_time) * RTT_AGE
         if half_rtt < self.min_half_rtt + aged_rtt:
             self.min_half_rtt = half_rtt
@@ -98,19 +117,23 @@ class ClockSync:
                          sent_time, self.clock_est[2], clock - exp_clock,
                          math.sqrt(self.prediction_variance))
             self.prediction_variance = (.001 * self.mcu_freq)**2
+            self.fast_query_count = 0
         else:
             self.last_prediction_time = sent_time
             self.prediction_variance = (
                 (1. - DECAY) * (self.prediction_variance + clock_diff2 * DECAY))
-        # Add clock and sent_time to linear regression
+        # Add clock and sent_time to linear regression (weight the
+        # initial samples equally so the regression converges quickly)
+        self.sample_count += 1
+        decay = max(DECAY, 1. / (self.sample_count + 1))
         diff_sent_time = sent_time - self.time_avg
-        self.time_avg += DECAY * diff_sent_time
-        self.time_variance = (1. - DECAY) * (
-            self.time_variance + diff_sent_time**2 * DECAY)
+        self.time_avg += decay * diff_sent_time
+        self.time_variance = (1. - decay) * (
+            self.time_variance + diff_sent_time**2 * decay)
         diff_clock = clock - self.clock_avg
-        self.clock_avg += DECAY * diff_clock
-        self.clock_covariance = (1. - DECAY) * (
-            self.clock_covariance + diff_sent_time * diff_clock * DECAY)
+        self.clock_avg += decay * diff_clock
+        self.clock_covariance = (1. - decay) * (
+            self.clock_covariance + diff_sent_time * diff_clock * decay)
         # Update prediction from linear regression
         new_freq = self.clock_covariance / self.time_variance
         pred_stddev = math.sqrt(self.prediction_variance)
@@ -153,9 +176,21 @@ class ClockSync:
                     self.time_avg, self.time_variance,
                     self.clock_avg, self.clock_covariance,
                     self.prediction_variance))
-    def stats(self, eventtime):
+    def _get_sync_stats(self):
         sample_time, clock, freq = self.clock_est
-        return "freq=%d" % (freq,)
+        stddev = math.sqrt(self.prediction_variance) / self.mcu_freq
+        return freq, self.last_rtt, stddev
+    def stats(self, eventtime):
+        freq, rtt, stddev = self._get_sync_stats()
+        self.history.append((eventtime, freq, rtt, stddev))
+        return "freq=%d rtt=%.6f clock_stddev=%.6f" % (freq, rtt, stddev)
+    def get_status(self, eventtime):
+        freq, rtt, stddev = self._get_sync_stats()
+        history = list(self.history)
+        return {'freq': freq, 'rtt': rtt, 'clock_stddev': stddev,
+                'freq_history': [(t, f) for t, f, r, s in history],
+                'rtt_history': [(t, r) for t, f, r, s in history],
+                'clock_stddev_history': [(t, s) for t, f, r, s in history]}
     def calibrate_clock(self, print_time, eventtime):
         return (0., self.mcu_freq)
 
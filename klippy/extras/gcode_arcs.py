@@ -0,0 +1,64 @@
+# Support for G2/G3 arc moves
+#
+# Copyright (C) 2018  Kevin O'Connor <kevin@koconnor.net>
+#
+# This file may be distributed under the terms of the GNU GPLv3 license.
+import math
+
+class GCodeArcs:
+    def __init__(self, config):
+        self.printer = config.get_printer()
+        self.chord_tolerance = config.getfloat(
+            'chord_tolerance', 0.010, above=0.)
+        self.gcode = self.printer.lookup_object('gcode')
+        self.gcode.register_command('G2', self.cmd_G2)
+        self.gcode.register_command('G3', self.cmd_G3)
+    def cmd_G2(self, params):
+        # Clockwise arc move
+        self._arc_move(params, True)
+    def cmd_G3(self, params):
+        # Counter-clockwise arc move
+        self._arc_move(params, False)
+    def _arc_move(self, params, clockwise):
+        gcode = self.gcode
+        if 'R' in params:
+            raise gcode.error("G2/G3 R parameter not supported")
+        offset_x = gcode.get_float('I', params, 0.)
+        offset_y = gcode.get_float('J', params, 0.)
+        if not offset_x and not offset_y:
+            raise gcode.error("G2/G3 requires an I or J parameter")
+        start = list(gcode.last_position)
+        end = gcode.get_move_position(params)
+        gcode.move_path(
+            self.plan_arc(start, end, offset_x, offset_y, clockwise))
+    def plan_arc(self, start, end, offset_x, offset_y, clockwise):
+        # Determine the angle swept from the start to the end position
+        center_x = start[0] + offset_x
+        center_y = start[1] + offset_y
+        r_x, r_y = -offset_x, -offset_y
+        rt_x, rt_y = end[0] - center_x, end[1] - center_y
+        angle = math.atan2(r_x * rt_y - r_y * rt_x, r_x * rt_x + r_y * rt_y)
+        if clockwise:
+            if angle >= 0.:
+                angle -= 2. * math.pi
+        elif angle <= 0.:
+            angle += 2. * math.pi
+        # Use the fewest segments that keep each chord within tolerance
+        radius = math.sqrt(r_x * r_x + r_y * r_y)
+        tolerance = min(self.chord_tolerance, radius)
+        segment_angle = 2. * math.acos(1. - tolerance / radius)
+        segments = max(1, int(math.ceil(abs(angle) / segment_angle)))
+        # Generate the segment end positions (z and e move linearly)
+        d_z, d_e = end[2] - start[2], end[3] - start[3]
+        path = []
+        for i in range(1, segments):
+            t = float(i) / segments
+            cos_a, sin_a = math.cos(angle * t), math.sin(angle * t)
+            path.append([center_x + r_x * cos_a - r_y * sin_a,
+                         center_y + r_x * sin_a + r_y * cos_a,
+                         start[2] + d_z * t, start[3] + d_e * t])
+        path.append(end)
+        return path
+
+def load_config(config):
+    return GCodeArcs(config)
@@ -44,6 +44,9 @@ class GCodeParser:
             self.register_command(cmd, func, wnr, desc)
             for a in getattr(self, 'cmd_' + cmd + '_aliases', []):
                 self.register_command(a, func, wnr)
+        # Handlers that process_commands() may dispatch via _process_move()
+        self.move_handlers = set([self.ready_gcode_handlers['G1'],
+                                  self.ready_gcode_handlers['G0']])
         # G-Code coordinate manipulation
         self.absolutecoord = self.absoluteextrude = True
         self.base_position = [0.0, 0.0, 0.0, 0.0]
@@ -52,6 +55,7 @@ class GCodeParser:
         self.speed_factor = 1. / 60.
         self.extrude_factor = 1.
         self.move_transform = self.move_with_transform = None
+        self.move_batch = None
         self.position_with_transform = (lambda: [0., 0., 0., 0.])
         # G-Code state
         self.need_ack = False
@@ -59,6 +63,7 @@ class GCodeParser:
         self.heater = None
         self.speed = 25. * 60.
         self.axis2pos = {'X': 0, 'Y': 1, 'Z': 2, 'E': 3}
+        self.move_params = {'X': 0, 'Y': 1, 'Z': 2, 'E': 3, 'F': 4}
     def register_command(self, cmd, func, when_not_ready=False, desc=None):
         if func is None:
             if cmd in self.ready_gcode_handlers:
@@ -140,6 +145,7 @@ class GCodeParser:
         self.toolhead = self.printer.lookup_object('toolhead')
         if self.move_transform is None:
             self.move_with_transform = self.toolhead.move
+            self.move_batch = self.toolhead.move_batch
             self.position_with_transform = self.toolhead.get_position
         extruders = kinematics.extruder.get_printer_extruders(self.printer)
         if extruders:
@@ -166,44 +172,87 @@ class GCodeParser:
                 self.speed_factor, self.extrude_factor, self.speed))
         logging.info("\n".join(out))
     # Parse input into commands
-    args_r = re.compile('([A-Z_]+|[A-Z*/])')
+    args_r = re.compile(r'([A-Z_]+|[A-Z*/])\s*'
+                        r'([^A-Z_*/\s]*(?:\s+[^A-Z_*/\s]+)*)\s*')
+    def _tokenize(self, line):
+        # Ignore comments and leading/trailing spaces
+        line = origline = line.strip()
+        cpos = line.find(';')
+        if cpos >= 0:
+            line = line[:cpos]
+        # Break command into (name, stripped value) pairs
+        parts = self.args_r.findall(line.upper())
+        cpart = 0
+        if parts and parts[0][0] == 'N':
+            # Skip line number at start of command
+            cpart = 1
+        if len(parts) > cpart:
+            cmd = parts[cpart][0] + parts[cpart][1]
+        else:
+            # Treat empty line as empty command
+            cmd = ''
+        return origline, parts, cmd
     def process_commands(self, commands, need_ack=True):
-        for line in commands:
-            # Ignore comments and leading/trailing spaces
-            line = origline = line.strip()
-            cpos = line.find(';')
-            if cpos >= 0:
-                line = line[:cpos]
-            # Break command into parts
-            parts = self.args_r.split(line.upper())[1:]
-            params = { parts[i]: parts[i+1].strip()
-                       for i in range(0, len(parts), 2) }
-            params['#original'] = origline
-            if parts and parts[0] == 'N':
-                # Skip line number at start of command
-                del parts[:2]
-            if not parts:
-                # Treat empty line as empty command
-                parts = ['', '']
-            params['#command'] = cmd = parts[0] + parts[1].strip()
+        lines = [self._tokenize(line) for line in commands]
+        move_handlers = self.move_handlers
+        index = 0
+        while index < len(lines):
+            origline, parts, cmd = lines[index]
             # Invoke handler for command
             self.need_ack = need_ack
             handler = self.gcode_handlers.get(cmd, self.cmd_default)
+            progress = [index]
             try:
-                handler(params)
+                if handler not in move_handlers:
+                    params = dict(parts)
+                    params['#original'] = origline
+                    params['#command'] = cmd
+                    handler(params)
+                elif self.move_batch is None:
+                    # G0/G1 moves skip params dictionary construction
+                    self._process_move(parts, origline)
+                else:
+                    # Submit a run of consecutive moves to the toolhead
+                    end = index + 1
+                    while (end < len(lines) and self.gcode_handlers.get(
+                            lines[end][2]) in move_handlers):
+                        end += 1
+                    try:
+                        self.move_batch(
+                            self._iter_moves(lines, progress, end, need_ack))
+                    except homing.EndstopError as e:
+                        raise error(str(e))
+                    index = progress[0]
+                    continue
             except error as e:
                 self.respond_error(str(e))
                 self.reset_last_position()
                 if not need_ack:
                     raise
             except:
-                msg = 'Internal error on command:"%s"' % (cmd,)
+                msg = 'Internal error on command:"%s"' % (
+                    lines[progress[0]][2],)
                 logging.exception(msg)
                 self.printer.invoke_shutdown(msg)
                 self.respond_error(msg)
                 if not need_ack:
                     raise
             self.ack()
+            index = progress[0] + 1
+    def _iter_moves(self, lines, progress, end, need_ack):
+        # Generate toolhead moves for a run of G0/G1 lines.  The index
+        # of the line being processed is stored in progress[0].
+        gcode_handlers = self.gcode_handlers
+        index = progress[0]
+        while index < end and self.gcode_handlers is gcode_handlers:
+            progress[0] = index
+            origline, parts, cmd = lines[index]
+            self.need_ack = need_ack
+            self._parse_move(parts, origline)
+            yield self.last_position, self.speed * self.speed_factor
+            self.ack()
+            index += 1
+        progress[0] = index
     m112_r = re.compile('^(?:[nN][0-9]+)?\s*[mM]112(?:\s|$)')
     def process_data(self, eventtime):
         # Read input, separate by newline, and add to pending_commands
@@ -473,36 +522,72 @@ class GCodeParser:
     cmd_G1_aliases = ['G0']
     def cmd_G1(self, params):
         # Move
+        self._process_move(params.items(), params['#original'])
+    def _process_move(self, parts, origline):
+        self._parse_move(parts, origline)
         try:
-            for axis in 'XYZ':
-                if axis in params:
-                    v = float(params[axis])
-                    pos = self.axis2pos[axis]
+            self.move_with_transform(self.last_position,
+                                     self.speed * self.speed_factor)
+        except homing.EndstopError as e:
+            raise error(str(e))
+    def _parse_move(self, parts, origline):
+        # Parse move parameters directly into last_position
+        move_params = self.move_params
+        values = [None, None, None, None, None]
+        for name, value in parts:
+            pos = move_params.get(name)
+            if pos is not None:
+                values[pos] = value
+        last_position = self.last_position
+        try:
+            for pos in (0, 1, 2):
+                v = values[pos]
+                if v is not None:
+                    v = float(v)
                     if not self.absolutecoord:
                         # value relative to position of last move
-                        self.last_position[pos] += v
+                        last_position[pos] += v
                     else:
                         # value relative to base coordinate position
-                        self.last_position[pos] = v + self.base_position[pos]
-            if 'E' in params:
-                v = float(params['E']) * self.extrude_factor
+                        last_position[pos] = v + self.base_position[pos]
+            v = values[3]
+            if v is not None:
+                v = float(v) * self.extrude_factor
                 if not self.absolutecoord or not self.absoluteextrude:
                     # value relative to position of last move
-                    self.last_position[3] += v
+                    last_position[3] += v
                 else:
                     # value relative to base coordinate position
-                    self.last_position[3] = v + self.base_position[3]
-            if 'F' in params:
-                speed = float(params['F'])
+                    last_position[3] = v + self.base_position[3]
+            v = values[4]
+            if v is not None:
+                speed = float(v)
                 if speed <= 0.:
-                    raise error("Invalid speed in '%s'" % (params['#original'],))
+                    raise error("Invalid speed in '%s'" % (origline,))
                 self.speed = speed
         except ValueError as e:
-            raise error("Unable to parse move '%s'" % (params['#original'],))
+            raise error("Unable to parse move '%s'" % (origline,))
+    def get_move_position(self, params):
+        # Return the position a G1 command with the given parameters
+        # would move to (an F parameter also updates the speed)
+        last_position = list(self.last_position)
         try:
-            self.move_with_transform(self.last_position, self.speed * self.speed_factor)
+            self._parse_move(params.items(), params['#original'])
+            return list(self.last_position)
+        finally:
+            self.last_position[:] = last_position
+    def move_path(self, path):
+        # Move through a list of positions at the current speed
+        speed = self.speed * self.speed_factor
+        try:
+            if self.move_batch is not None:
+                self.move_batch([(pos, speed) for pos in path])
+            else:
+                for pos in path:
+                    self.move_with_transform(pos, speed)
         except homing.EndstopError as e:
             raise error(str(e))
+        self.last_position[:] = path[-1]
     def cmd_G4(self, params):
         # Dwell
         if 'S' in params:
@@ -17,6 +17,8 @@ class CoreXYKinematics:
         self.rails[0].setup_itersolve('corexy_stepper_alloc', '+')
         self.rails[1].setup_itersolve('corexy_stepper_alloc', '-')
         self.rails[2].setup_itersolve('cartesian_stepper_alloc', 'z')
+        self.xy_group = stepper.setup_stepper_group(
+            self.rails[0].get_steppers() + self.rails[1].get_steppers())
         # Setup boundary checks
         max_velocity, max_accel = toolhead.get_max_velocity()
         self.max_z_velocity = config.getfloat(
@@ -107,12 +109,10 @@ class CoreXYKinematics:
             self._check_motor_enable(print_time, move)
         axes_d = move.axes_d
         cmove = move.cmove
-        rail_x, rail_y, rail_z = self.rails
         if axes_d[0] or axes_d[1]:
-            rail_x.step_itersolve(cmove)
-            rail_y.step_itersolve(cmove)
+            self.xy_group.step_itersolve(cmove)
         if axes_d[2]:
-            rail_z.step_itersolve(cmove)
+            self.rails[2].step_itersolve(cmove)
 
 def load_kinematics(toolhead, config):
     return CoreXYKinematics(toolhead, config)
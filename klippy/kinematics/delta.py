@@ -23,6 +23,8 @@ class DeltaKinematics:
             stepper_configs[2], need_position_minmax = False,
             default_position_endstop=a_endstop)
         self.rails = [rail_a, rail_b, rail_c]
+        self.stepper_group = stepper.setup_stepper_group(
+            [s for rail in self.rails for s in rail.get_steppers()])
         # Setup stepper max halt velocity
         self.max_velocity, self.max_accel = toolhead.get_max_velocity()
         self.max_z_velocity = config.getfloat(
@@ -149,8 +151,7 @@ class DeltaKinematics:
     def move(self, print_time, move):
         if self.need_motor_enable:
             self._check_motor_enable(print_time)
-        for rail in self.rails:
-            rail.step_itersolve(move.cmove)
+        self.stepper_group.step_itersolve(move.cmove)
     # Helper function for DELTA_CALIBRATE script
     def get_calibrate_params(self):
         out = { 'radius': self.radius }
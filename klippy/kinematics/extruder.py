@@ -6,8 +6,6 @@
 import math, logging
 import stepper, homing, chelper
 
-EXTRUDE_DIFF_IGNORE = 1.02
-
 class PrinterExtruder:
     def __init__(self, config, extruder_num):
         self.printer = config.get_printer()
@@ -106,20 +104,6 @@ class PrinterExtruder:
                 "Move exceeds maximum extrusion (%.3fmm^2 vs %.3fmm^2)\n"
                 "See the 'max_extrude_cross_section' config option for details"
                 % (area, self.max_extrude_ratio * self.filament_area))
-    def calc_junction(self, prev_move, move):
-        extrude = move.axes_d[3]
-        prev_extrude = prev_move.axes_d[3]
-        if extrude or prev_extrude:
-            if not extrude or not prev_extrude:
-                # Extrude move to non-extrude move - disable lookahead
-                return 0.
-            if ((move.extrude_r > prev_move.extrude_r * EXTRUDE_DIFF_IGNORE
-                 or prev_move.extrude_r > move.extrude_r * EXTRUDE_DIFF_IGNORE)
-                and abs(move.move_d * prev_move.extrude_r - extrude) >= .001):
-                # Extrude ratio between moves is too different
-                return 0.
-            move.extrude_r = prev_move.extrude_r
-        return move.max_cruise_v2
     def lookahead(self, moves, flush_count, lazy):
         lookahead_t = self.pressure_advance_lookahead_time
         if not self.pressure_advance or not lookahead_t:
@@ -227,8 +211,6 @@ class DummyExtruder:
     def check_move(self, move):
         raise homing.EndstopMoveError(
             move.end_pos, "Extrude when no extruder present")
-    def calc_junction(self, prev_move, move):
-        return move.max_cruise_v2
     def lookahead(self, moves, flush_count, lazy):
         return flush_count
 
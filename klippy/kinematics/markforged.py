@@ -49,6 +49,10 @@ class MarkforgedKinematics:
             self.printer.lookup_object('gcode').register_command(
                 'SET_DUAL_CARRIAGE', self.cmd_SET_DUAL_CARRIAGE,
                 desc=self.cmd_SET_DUAL_CARRIAGE_help)
+        self._setup_xy_group()
+    def _setup_xy_group(self):
+        self.xy_group = stepper.setup_stepper_group(
+            self.rails[0].get_steppers() + self.rails[1].get_steppers())
     def get_steppers(self, flags=""):
         if flags == "Z":
             return self.rails[2].get_steppers()
@@ -142,12 +146,10 @@ class MarkforgedKinematics:
             self._check_motor_enable(print_time, move)
         axes_d = move.axes_d
         cmove = move.cmove
-        rail_x, rail_y, rail_z = self.rails
         if axes_d[0] or axes_d[1]:
-            rail_x.step_itersolve(cmove)
-            rail_y.step_itersolve(cmove)
+            self.xy_group.step_itersolve(cmove)
         if axes_d[2]:
-            rail_z.step_itersolve(cmove)
+            self.rails[2].step_itersolve(cmove)
     # Dual carriage support
     def _activate_carriage(self, carriage):
         toolhead = self.printer.lookup_object('toolhead')
@@ -155,6 +157,7 @@ class MarkforgedKinematics:
         dc_rail = self.dual_carriage_rails[carriage]
         dc_axis = self.dual_carriage_axis
         self.rails[dc_axis] = dc_rail
+        self._setup_xy_group()
         extruder_pos = toolhead.get_position()[3]
         toolhead.set_position(self.calc_position() + [extruder_pos])
         if self.limits[dc_axis][0] <= self.limits[dc_axis][1]:
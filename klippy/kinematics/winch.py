@@ -20,6 +20,7 @@ class WinchKinematics:
             a = tuple([stepper_config.getfloat('anchor_' + n) for n in 'xyz'])
             self.anchors.append(a)
             s.setup_itersolve('winch_stepper_alloc', *a)
+        self.stepper_group = stepper.setup_stepper_group(self.steppers)
         # Setup stepper max halt velocity
         max_velocity, max_accel = toolhead.get_max_velocity()
         max_halt_velocity = toolhead.get_max_axis_halt()
@@ -55,8 +56,7 @@ class WinchKinematics:
     def move(self, print_time, move):
         if self.need_motor_enable:
             self._check_motor_enable(print_time)
-        for s in self.steppers:
-            s.step_itersolve(move.cmove)
+        self.stepper_group.step_itersolve(move.cmove)
 
 def load_kinematics(toolhead, config):
     return WinchKinematics(toolhead, config)
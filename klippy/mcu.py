@@ -66,6 +66,11 @@ class MCU_stepper:
         self._ffi_lib.stepcompress_fill(
             self._stepqueue, self._mcu.seconds_to_clock(max_error),
             self._invert_dir, step_cmd_id, dir_cmd_id)
+        step_delta_cmd_id = self._mcu.try_lookup_command_id(
+            "queue_step_delta oid=%c interval_delta=%i count=%hu add=%hi")
+        if step_delta_cmd_id is not None:
+            self._ffi_lib.stepcompress_set_delta_msgid(
+                self._stepqueue, step_delta_cmd_id)
     def get_oid(self):
         return self._oid
     def get_step_dist(self):
@@ -102,6 +107,11 @@ class MCU_stepper:
         else:
             self._itersolve_gen_steps = self._ffi_lib.itersolve_gen_steps
         return was_ignore
+    def get_active_kinematics(self):
+        # Return the stepper kinematics (or None if moves are ignored)
+        if self._itersolve_gen_steps is not self._ffi_lib.itersolve_gen_steps:
+            return None
+        return self._stepper_kinematics
     def note_homing_start(self, homing_clock):
         ret = self._ffi_lib.stepcompress_set_homing(
             self._stepqueue, homing_clock)
@@ -133,6 +143,28 @@ class MCU_stepper:
         if ret:
             raise error("Internal error in stepcompress")
 
+# Generate the steps of several steppers during a move (the C code
+# may generate the steps of each stepper concurrently)
+class MCU_stepper_group:
+    def __init__(self, mcu_steppers):
+        self._mcu_steppers = mcu_steppers
+        self._ffi_main, self._ffi_lib = chelper.get_ffi()
+        self._sk_list = None
+        self._sk_array = None
+        self._sk_count = 0
+    def step_itersolve(self, cmove):
+        sk_list = [s.get_active_kinematics() for s in self._mcu_steppers]
+        if sk_list != self._sk_list:
+            self._sk_list = sk_list
+            sks = [sk for sk in sk_list if sk is not None]
+            self._sk_array = self._ffi_main.new(
+                'struct stepper_kinematics *[]', sks)
+            self._sk_count = len(sks)
+        ret = self._ffi_lib.itersolve_gen_steps_multi(
+            self._sk_array, self._sk_count, cmove)
+        if ret:
+            raise error("Internal error in stepcompress")
+
 class MCU_endstop:
     class TimeoutError(Exception):
         pass
@@ -676,6 +708,11 @@ class MCU:
             return None
     def lookup_command_id(self, msgformat):
         return self._serial.msgparser.lookup_command(msgformat).msgid
+    def try_lookup_command_id(self, msgformat):
+        try:
+            return self.lookup_command_id(msgformat)
+        except self._serial.msgparser.error as e:
+            return None
     def get_constant_float(self, name):
         return self._serial.msgparser.get_constant_float(name)
     def print_time_to_clock(self, print_time):
@@ -744,16 +781,13 @@ class MCU:
         return self._printer.get_start_args().get('debugoutput') is not None
     def is_shutdown(self):
         return self._is_shutdown
-    def flush_moves(self, print_time):
+    def get_flush_clock(self, print_time):
         if self._steppersync is None:
-            return
+            return None
         clock = self.print_time_to_clock(print_time)
         if clock < 0:
-            return
-        ret = self._ffi_lib.steppersync_flush(self._steppersync, clock)
-        if ret:
-            raise error("Internal error in MCU '%s' stepcompress" % (
-                self._name,))
+            return None
+        return self._steppersync, clock
     def check_active(self, print_time, eventtime):
         if self._steppersync is None:
             return
@@ -771,11 +805,31 @@ class MCU:
         msg = "%s: mcu_awake=%.03f mcu_task_avg=%.06f mcu_task_stddev=%.06f" % (
             self._name, self._mcu_tick_awake, self._mcu_tick_avg,
             self._mcu_tick_stddev)
+        if self._stepqueues:
+            queue_max = max([self._ffi_lib.stepcompress_get_queue_max(sq)
+                             for sq in self._stepqueues])
+            msg += " step_queue_max=%d" % (queue_max,)
         return False, ' '.join([msg, self._serial.stats(eventtime),
                                 self._clocksync.stats(eventtime)])
+    def get_status(self, eventtime):
+        return self._clocksync.get_status(eventtime)
     def __del__(self):
         self._disconnect()
 
+# Flush the moves of several micro-controllers up to a common
+# print_time (the step queues of the mcus are flushed concurrently)
+def flush_all_moves(mcus, print_time):
+    flushes = [(m, m.get_flush_clock(print_time)) for m in mcus]
+    flushes = [(m, f) for m, f in flushes if f is not None]
+    if not flushes:
+        return
+    ffi_main, ffi_lib = chelper.get_ffi()
+    ss_list, clocks = zip(*[f for m, f in flushes])
+    ret = ffi_lib.steppersync_flush_multi(ss_list, clocks, len(flushes))
+    if ret:
+        raise error("Internal error in MCU '%s' stepcompress" % (
+            flushes[ret - 1][0]._name,))
+
 Common_MCU_errors = {
     ("Timer too close", "No next step", "Missed scheduling of next "): """
 This is generally indicative of an intermittent
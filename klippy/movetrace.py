@@ -0,0 +1,87 @@
+# Record (and read back) the moves submitted to the toolhead
+#
+# Copyright (C) 2018  Kevin O'Connor <kevin@koconnor.net>
+#
+# This file may be distributed under the terms of the GNU GPLv3 license.
+import struct
+
+class error(Exception):
+    pass
+
+TRACE_MAGIC = "klippy-move-trace"
+TRACE_VERSION = 1
+
+# Each record is a one byte type followed by little-endian doubles
+RECORD_FORMATS = {
+    # Move: x, y, z, e, speed
+    'M': struct.Struct('<5d'),
+    # Set position: x, y, z, e
+    'P': struct.Struct('<4d'),
+    # Velocity limits: max_velocity, max_accel, max_accel_to_decel,
+    # junction_deviation
+    'L': struct.Struct('<4d'),
+    # Dwell: delay
+    'D': struct.Struct('<d'),
+    # Full flush of the look-ahead queue
+    'F': struct.Struct(''),
+}
+
+# The trace file starts with a one line text header describing the
+# kinematics and the step distance of each stepper.
+class MoveTraceWriter:
+    def __init__(self, filename, kin_name, steppers):
+        self.tracefile = open(filename, 'wb')
+        header = ["%s %d kinematics=%s" % (TRACE_MAGIC, TRACE_VERSION,
+                                           kin_name)]
+        header.extend(["%s=%.9f" % (name, step_dist)
+                       for name, step_dist in steppers])
+        self.tracefile.write(' '.join(header) + '\n')
+        self.write = self.tracefile.write
+        self.move_pack = RECORD_FORMATS['M'].pack
+        self.limits = None
+    def close(self):
+        self.tracefile.close()
+    def note_limits(self, max_velocity, max_accel, max_accel_to_decel,
+                    junction_deviation):
+        limits = (max_velocity, max_accel, max_accel_to_decel,
+                  junction_deviation)
+        if limits != self.limits:
+            self.limits = limits
+            self.write('L' + RECORD_FORMATS['L'].pack(*limits))
+    def record_move(self, newpos, speed):
+        self.write('M' + self.move_pack(newpos[0], newpos[1], newpos[2],
+                                        newpos[3], speed))
+    def record_moves(self, moves):
+        # Record the (newpos, speed) pairs of an iterable of moves
+        for newpos, speed in moves:
+            self.write('M' + self.move_pack(newpos[0], newpos[1], newpos[2],
+                                            newpos[3], speed))
+            yield newpos, speed
+    def record_position(self, newpos):
+        self.write('P' + RECORD_FORMATS['P'].pack(*newpos[:4]))
+    def record_dwell(self, delay):
+        self.write('D' + RECORD_FORMATS['D'].pack(delay))
+    def record_flush(self):
+        self.write('F')
+
+# Read a trace file - returns a dictionary of header information and
+# a list of (record_type, values) tuples
+def read_trace(filename):
+    f = open(filename, 'rb')
+    header = f.readline().split()
+    data = f.read()
+    f.close()
+    if (len(header) < 3 or header[0] != TRACE_MAGIC
+        or header[1] != str(TRACE_VERSION)):
+        raise error("File '%s' is not a move trace" % (filename,))
+    info = dict([p.split('=', 1) for p in header[2:]])
+    records = []
+    pos = 0
+    while pos < len(data):
+        rtype = data[pos]
+        fmt = RECORD_FORMATS.get(rtype)
+        if fmt is None or pos + 1 + fmt.size > len(data):
+            raise error("Invalid move trace record at offset %d" % (pos,))
+        records.append((rtype, fmt.unpack_from(data, pos + 1)))
+        pos += 1 + fmt.size
+    return info, records
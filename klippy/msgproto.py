@@ -22,20 +22,50 @@ MESSAGE_PAYLOAD_MAX = MESSAGE_MAX - MESSAGE_MIN
 MESSAGE_SEQ_MASK = 0x0f
 MESSAGE_DEST = 0x10
 MESSAGE_SYNC = '\x7E'
+MESSAGE_SYNC_BYTE = 0x7E
 
 class error(Exception):
     pass
 
-def crc16_ccitt(buf):
-    crc = 0xffff
-    for data in buf:
-        data = ord(data)
-        data ^= crc & 0xff
+def _build_crc16_table():
+    table = []
+    for data in range(256):
         data ^= (data & 0x0f) << 4
-        crc = ((data << 8) | (crc >> 8)) ^ (data >> 4) ^ (data << 3)
-    crc = chr(crc >> 8) + chr(crc & 0xff)
+        table.append(((data << 8) ^ (data >> 4) ^ (data << 3)) & 0xffff)
+    return table
+CRC16_TABLE = _build_crc16_table()
+
+def _py_crc16(buf):
+    crc = 0xffff
+    for data in bytearray(buf):
+        crc = (crc >> 8) ^ CRC16_TABLE[(crc ^ data) & 0xff]
     return crc
 
+# Use the C crc implementation (if the C helper code is available)
+def _load_crc16():
+    try:
+        import chelper
+        ffi_main, ffi_lib = chelper.get_ffi()
+    except Exception:
+        logging.debug("Using python crc16_ccitt implementation")
+        return _py_crc16
+    c_crc16_ccitt = ffi_lib.crc16_ccitt
+    from_buffer = ffi_main.from_buffer
+    def crc16(buf):
+        if type(buf) is not str:
+            buf = from_buffer(buf)
+        return c_crc16_ccitt(buf, len(buf))
+    return crc16
+
+def _crc16(buf):
+    global _crc16
+    _crc16 = _load_crc16()
+    return _crc16(buf)
+
+def crc16_ccitt(buf):
+    crc = _crc16(buf)
+    return chr(crc >> 8) + chr(crc & 0xff)
+
 class PT_uint32:
     is_int = 1
     max_length = 5
@@ -46,6 +76,35 @@ class PT_uint32:
         if v >= 0x3000 or v < -0x1000:       out.append((v>>14) & 0x7f | 0x80)
         if v >= 0x60 or v < -0x20:           out.append((v>>7)  & 0x7f | 0x80)
         out.append(v & 0x7f)
+    def gen_encode(self):
+        # Python code (for MessageFormat.create_encoder) that stores
+        # the value 'v' into 'buf' at 'pos'
+        return [
+            "if -0x20 <= v < 0x60:",
+            "    buf[pos] = v & 0x7f",
+            "    pos += 1",
+            "elif -0x1000 <= v < 0x3000:",
+            "    buf[pos] = (v>>7) & 0x7f | 0x80",
+            "    buf[pos+1] = v & 0x7f",
+            "    pos += 2",
+            "elif -0x80000 <= v < 0x180000:",
+            "    buf[pos] = (v>>14) & 0x7f | 0x80",
+            "    buf[pos+1] = (v>>7) & 0x7f | 0x80",
+            "    buf[pos+2] = v & 0x7f",
+            "    pos += 3",
+            "elif -0x4000000 <= v < 0xc000000:",
+            "    buf[pos] = (v>>21) & 0x7f | 0x80",
+            "    buf[pos+1] = (v>>14) & 0x7f | 0x80",
+            "    buf[pos+2] = (v>>7) & 0x7f | 0x80",
+            "    buf[pos+3] = v & 0x7f",
+            "    pos += 4",
+            "else:",
+            "    buf[pos] = (v>>28) & 0x7f | 0x80",
+            "    buf[pos+1] = (v>>21) & 0x7f | 0x80",
+            "    buf[pos+2] = (v>>14) & 0x7f | 0x80",
+            "    buf[pos+3] = (v>>7) & 0x7f | 0x80",
+            "    buf[pos+4] = v & 0x7f",
+            "    pos += 5"]
     def parse(self, s, pos):
         c = s[pos]
         pos += 1
@@ -76,6 +135,15 @@ class PT_string:
     def encode(self, out, v):
         out.append(len(v))
         out.extend(bytearray(v))
+    def gen_encode(self):
+        return [
+            "v = bytearray(v)",
+            "end = pos + 1 + len(v)",
+            "if end > len(buf):",
+            "    raise IndexError",
+            "buf[pos] = len(v)",
+            "buf[pos+1:end] = v",
+            "pos = end"]
     def parse(self, s, pos):
         l = s[pos]
         return str(bytearray(s[pos+1:pos+l+1])), pos+l+1
@@ -120,6 +188,25 @@ class MessageFormat:
         for name, t in self.param_names:
             t.encode(out, params[name])
         return out
+    def create_encoder(self, buf):
+        # Generate a function specialized for this message that
+        # encodes a list of parameters into the bytearray 'buf' and
+        # returns the encoded length
+        code = ["buf[0] = %d" % (self.msgid,), "pos = 1"]
+        for i, t in enumerate(self.param_types):
+            code.append("v = params[%d]" % (i,))
+            code.extend(t.gen_encode())
+        code.append("return pos")
+        src = "\n".join(
+            ["def encode(params):", "  try:"]
+            + ["    " + line for line in code]
+            + ["  except IndexError:",
+               "    if len(params) < %d:" % (len(self.param_types),),
+               "      raise",
+               "    raise error('Message too long: %s' % (name,))"])
+        env = {'buf': buf, 'error': error, 'name': self.name}
+        exec src in env
+        return env['encode']
     def parse(self, s, pos):
         pos += 1
         out = {}
@@ -191,22 +278,30 @@ class MessageParser:
         self.version = self.build_versions = ""
         self.raw_identify_data = ""
         self._init_messages(DefaultMessages, DefaultMessages.keys())
-    def check_packet(self, s):
-        if len(s) < MESSAGE_MIN:
+    def check_packet(self, s, pos=0):
+        # Check for a valid message in 's' (a str or bytearray) at
+        # 'pos' - returns the message length, 0 if more data is
+        # needed, or a negative number of bytes to discard
+        if isinstance(s, str):
+            s = bytearray(s[pos:pos+MESSAGE_MAX])
+            pos = 0
+        if len(s) - pos < MESSAGE_MIN:
             return 0
-        msglen = ord(s[MESSAGE_POS_LEN])
+        msglen = s[pos+MESSAGE_POS_LEN]
         if msglen < MESSAGE_MIN or msglen > MESSAGE_MAX:
             return -1
-        msgseq = ord(s[MESSAGE_POS_SEQ])
+        msgseq = s[pos+MESSAGE_POS_SEQ]
         if (msgseq & ~MESSAGE_SEQ_MASK) != MESSAGE_DEST:
             return -1
-        if len(s) < msglen:
+        if len(s) - pos < msglen:
             # Need more data
             return 0
-        if s[msglen-MESSAGE_TRAILER_SYNC] != MESSAGE_SYNC:
+        msgend = pos + msglen
+        if s[msgend-MESSAGE_TRAILER_SYNC] != MESSAGE_SYNC_BYTE:
             return -1
-        msgcrc = s[msglen-MESSAGE_TRAILER_CRC:msglen-MESSAGE_TRAILER_CRC+2]
-        crc = crc16_ccitt(s[:msglen-MESSAGE_TRAILER_SIZE])
+        msgcrc = ((s[msgend-MESSAGE_TRAILER_CRC] << 8)
+                  | s[msgend-MESSAGE_TRAILER_CRC+1])
+        crc = _crc16(s[pos:msgend-MESSAGE_TRAILER_SIZE])
         if crc != msgcrc:
             #logging.debug("got crc %s vs %s", repr(crc), repr(msgcrc))
             return -1
@@ -342,3 +437,35 @@ class MessageParser:
         return self.get_constant(name, default, parser=float)
     def get_constant_int(self, name, default=sentinel):
         return self.get_constant(name, default, parser=int)
+
+# Iterate over the messages found in a stream of serial port data (for
+# example, a --debugoutput capture).  The data is read into a buffer
+# in large blocks and messages are located using a read cursor.
+class PacketReader:
+    def __init__(self, msgparser, f, read_size=1024*1024):
+        self.msgparser = msgparser
+        self.f = f
+        self.read_size = read_size
+        self.invalid_bytes = 0
+    def __iter__(self):
+        check_packet = self.msgparser.check_packet
+        data = bytearray()
+        pos = 0
+        while 1:
+            newdata = self.f.read(self.read_size)
+            if not newdata:
+                break
+            del data[:pos]
+            data += newdata
+            pos = 0
+            while 1:
+                l = check_packet(data, pos)
+                if l == 0:
+                    break
+                if l < 0:
+                    logging.error("Invalid data")
+                    self.invalid_bytes -= l
+                    pos -= l
+                    continue
+                yield data[pos:pos+l]
+                pos += l
@@ -4,7 +4,7 @@
 # Copyright (C) 2016  Kevin O'Connor <kevin@koconnor.net>
 #
 # This file may be distributed under the terms of the GNU GPLv3 license.
-import os, sys, logging
+import sys
 import msgproto
 
 def read_dictionary(filename):
@@ -22,24 +22,9 @@ def main():
     mp.process_identify(dictionary, decompress=False)
 
     f = open(data_filename, 'rb')
-    fd = f.fileno()
-    data = ""
-    while 1:
-        newdata = os.read(fd, 4096)
-        if not newdata:
-            break
-        data += newdata
-        while 1:
-            l = mp.check_packet(data)
-            if l == 0:
-                break
-            if l < 0:
-                logging.error("Invalid data")
-                data = data[-l:]
-                continue
-            msgs = mp.dump(bytearray(data[:l]))
-            sys.stdout.write('\n'.join(msgs[1:]) + '\n')
-            data = data[l:]
+    for packet in msgproto.PacketReader(mp, f):
+        msgs = mp.dump(packet)
+        sys.stdout.write('\n'.join(msgs[1:]) + '\n')
 
 if __name__ == '__main__':
     main()
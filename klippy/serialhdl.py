@@ -23,6 +23,7 @@ class SerialReader:
         # C interface
         self.ffi_main, self.ffi_lib = chelper.get_ffi()
         self.serialqueue = None
+        self.msg_decoders = {}
         self.default_cmd_queue = self.alloc_command_queue()
         self.stats_buf = self.ffi_main.new('char[4096]')
         # Threading
@@ -41,7 +42,15 @@ class SerialReader:
             count = response.len
             if count <= 0:
                 break
-            params = self.msgparser.parse(response.msg[0:count])
+            num_args = response.num_args
+            if num_args >= 0:
+                # Integer parameters already decoded by the C code
+                name, names = self.msg_decoders[
+                    response.msg[msgproto.MESSAGE_HEADER_SIZE]]
+                params = dict(zip(names, response.args[0:num_args]))
+                params['#name'] = name
+            else:
+                params = self.msgparser.parse(response.msg[0:count])
             params['#sent_time'] = response.sent_time
             params['#receive_time'] = response.receive_time
             hdl = (params['#name'], params.get('oid'))
@@ -83,6 +92,7 @@ class SerialReader:
         msgparser = msgproto.MessageParser()
         msgparser.process_identify(identify_data)
         self.msgparser = msgparser
+        self._setup_msg_decoders()
         self.register_callback(self.handle_unknown, '#unknown')
         # Setup baud adjust
         mcu_baud = msgparser.get_constant_float('SERIAL_BAUD', None)
@@ -94,6 +104,21 @@ class SerialReader:
         if receive_window is not None:
             self.ffi_lib.serialqueue_set_receive_window(
                 self.serialqueue, receive_window)
+    def _setup_msg_decoders(self):
+        # Have the C code decode messages with only integer parameters
+        for msgid, mf in self.msgparser.messages_by_id.items():
+            if not isinstance(mf, msgproto.MessageFormat):
+                continue
+            names = [name for name, t in mf.param_names]
+            types = [t for name, t in mf.param_names]
+            if ([t for t in types if not t.is_int]
+                or 'static_string_id' in names
+                or len(names) > self.ffi_lib.MESSAGE_MAX_ARGS):
+                continue
+            self.msg_decoders[msgid] = (mf.name, names)
+            param_types = ''.join(['i' if t.signed else 'u' for t in types])
+            self.ffi_lib.serialqueue_set_msg_format(
+                self.serialqueue, msgid, param_types)
     def connect_file(self, debugoutput, dictionary, pace=False):
         self.ser = debugoutput
         self.msgparser.process_identify(dictionary, decompress=False)
@@ -125,9 +150,11 @@ class SerialReader:
         with self.lock:
             del self.handlers[name, oid]
     # Command sending
-    def raw_send(self, cmd, minclock, reqclock, cmd_queue):
+    def raw_send(self, cmd, minclock, reqclock, cmd_queue, cmdlen=None):
+        if cmdlen is None:
+            cmdlen = len(cmd)
         self.ffi_lib.serialqueue_send(
-            self.serialqueue, cmd_queue, cmd, len(cmd), minclock, reqclock)
+            self.serialqueue, cmd_queue, cmd, cmdlen, minclock, reqclock)
     def send(self, msg, minclock=0, reqclock=0):
         cmd = self.msgparser.create_command(msg)
         self.raw_send(cmd, minclock, reqclock, self.default_cmd_queue)
@@ -180,9 +207,15 @@ class SerialCommand:
         self.serial = serial
         self.cmd_queue = cmd_queue
         self.cmd = cmd
+        # Commands are encoded into a reusable buffer (so a command
+        # object should only be sent from a single thread)
+        buf = bytearray(msgproto.MESSAGE_PAYLOAD_MAX)
+        self.encode = cmd.create_encoder(buf)
+        self.cbuf = serial.ffi_main.from_buffer(buf)
     def send(self, data=(), minclock=0, reqclock=0):
-        cmd = self.cmd.encode(data)
-        self.serial.raw_send(cmd, minclock, reqclock, self.cmd_queue)
+        cmdlen = self.encode(data)
+        self.serial.raw_send(self.cbuf, minclock, reqclock, self.cmd_queue,
+                             cmdlen)
     def send_with_response(self, data=(), response=None, response_oid=None):
         cmd = self.cmd.encode(data)
         src = SerialRetryCommand(self.serial, cmd, response, response_oid)
@@ -4,7 +4,7 @@
 #
 # This file may be distributed under the terms of the GNU GPLv3 license.
 import math, logging, collections
-import homing
+import homing, mcu
 
 
 ######################################################################
@@ -99,6 +99,10 @@ class PrinterStepper:
     def is_motor_enabled(self):
         return not self.need_motor_enable
 
+# Generate the steps of several steppers during a move
+def setup_stepper_group(steppers):
+    return mcu.MCU_stepper_group([s.mcu_stepper for s in steppers])
+
 
 ######################################################################
 # Stepper controlled rails
@@ -179,7 +183,7 @@ class PrinterRail:
     def add_extra_stepper(self, config):
         stepper = PrinterStepper(config)
         self.steppers.append(stepper)
-        self.step_itersolve = self.step_multi_itersolve
+        self.step_itersolve = setup_stepper_group(self.steppers).step_itersolve
         mcu_endstop = self.endstops[0][0]
         endstop_pin = config.get('endstop_pin', None)
         if endstop_pin is not None:
@@ -194,9 +198,6 @@ class PrinterRail:
     def add_to_endstop(self, mcu_endstop):
         for stepper in self.steppers:
             stepper.add_to_endstop(mcu_endstop)
-    def step_multi_itersolve(self, cmove):
-        for stepper in self.steppers:
-            stepper.step_itersolve(cmove)
     def setup_itersolve(self, alloc_func, *params):
         for stepper in self.steppers:
             stepper.setup_itersolve(alloc_func, *params)
@@ -4,14 +4,24 @@
 #
 # This file may be distributed under the terms of the GNU GPLv3 license.
 import math, logging, importlib
-import mcu, homing, chelper, kinematics.extruder
+import mcu, homing, chelper, movetrace, kinematics.extruder
 
 # Common suffixes: _d is distance (in mm), _v is velocity (in
 #   mm/second), _v2 is velocity squared (mm^2/s^2), _t is time (in
 #   seconds), _r is ratio (scalar between 0.0 and 1.0)
 
 # Class to track each move request
-class Move:
+class Move(object):
+    # Many thousands of moves may be queued - use a fixed set of
+    # attributes (including those set by the extruder class)
+    __slots__ = (
+        'toolhead', 'start_pos', 'end_pos', 'accel', 'cmove',
+        'is_kinematic_move', 'axes_d', 'move_d', 'min_move_t',
+        'max_start_v2', 'max_cruise_v2', 'delta_v2',
+        'max_smoothed_v2', 'smooth_delta_v2',
+        'accel_r', 'decel_r', 'cruise_r', 'start_v', 'cruise_v', 'end_v',
+        'accel_t', 'cruise_t', 'decel_t',
+        'extrude_r', 'extrude_max_corner_v')
     def __init__(self, toolhead, start_pos, end_pos, speed):
         self.toolhead = toolhead
         self.start_pos = tuple(start_pos)
@@ -20,17 +30,21 @@ class Move:
         velocity = min(speed, toolhead.max_velocity)
         self.cmove = toolhead.cmove
         self.is_kinematic_move = True
-        self.axes_d = axes_d = [end_pos[i] - start_pos[i] for i in (0, 1, 2, 3)]
-        self.move_d = move_d = math.sqrt(sum([d*d for d in axes_d[:3]]))
+        axes_d = (end_pos[0] - start_pos[0], end_pos[1] - start_pos[1],
+                  end_pos[2] - start_pos[2], end_pos[3] - start_pos[3])
+        move_d = math.sqrt(axes_d[0]*axes_d[0] + axes_d[1]*axes_d[1]
+                           + axes_d[2]*axes_d[2])
         if move_d < .000000001:
             # Extrude only move
             self.end_pos = (start_pos[0], start_pos[1], start_pos[2],
                             end_pos[3])
-            axes_d[0] = axes_d[1] = axes_d[2] = 0.
-            self.move_d = move_d = abs(axes_d[3])
+            axes_d = (0., 0., 0., axes_d[3])
+            move_d = abs(axes_d[3])
             self.accel = 99999999.9
             velocity = speed
             self.is_kinematic_move = False
+        self.axes_d = axes_d
+        self.move_d = move_d
         self.min_move_t = move_d / velocity
         # Junction speeds are tracked in velocity squared.  The
         # delta_v2 is the maximum amount of this squared-velocity that
@@ -40,6 +54,8 @@ class Move:
         self.delta_v2 = 2.0 * move_d * self.accel
         self.max_smoothed_v2 = 0.
         self.smooth_delta_v2 = 2.0 * move_d * toolhead.max_accel_to_decel
+        # Extruder specific fields (see PrinterExtruder.check_move())
+        self.extrude_r = self.extrude_max_corner_v = 0.
     def limit_speed(self, speed, accel):
         speed2 = speed**2
         if speed2 < self.max_cruise_v2:
@@ -48,37 +64,6 @@ class Move:
         self.accel = min(self.accel, accel)
         self.delta_v2 = 2.0 * self.move_d * self.accel
         self.smooth_delta_v2 = min(self.smooth_delta_v2, self.delta_v2)
-    def calc_junction(self, prev_move):
-        if not self.is_kinematic_move or not prev_move.is_kinematic_move:
-            return
-        # Allow extruder to calculate its maximum junction
-        extruder_v2 = self.toolhead.extruder.calc_junction(prev_move, self)
-        # Find max velocity using approximated centripetal velocity as
-        # described at:
-        # https://onehossshay.wordpress.com/2011/09/24/improving_grbl_cornering_algorithm/
-        axes_d = self.axes_d
-        prev_axes_d = prev_move.axes_d
-        junction_cos_theta = -((axes_d[0] * prev_axes_d[0]
-                                + axes_d[1] * prev_axes_d[1]
-                                + axes_d[2] * prev_axes_d[2])
-                               / (self.move_d * prev_move.move_d))
-        if junction_cos_theta > 0.999999:
-            return
-        junction_cos_theta = max(junction_cos_theta, -0.999999)
-        sin_theta_d2 = math.sqrt(0.5*(1.0-junction_cos_theta))
-        R = self.toolhead.junction_deviation * sin_theta_d2 / (1. - sin_theta_d2)
-        tan_theta_d2 = sin_theta_d2 / math.sqrt(0.5*(1.0+junction_cos_theta))
-        move_centripetal_v2 = .5 * self.move_d * tan_theta_d2 * self.accel
-        prev_move_centripetal_v2 = (.5 * prev_move.move_d * tan_theta_d2
-                                    * prev_move.accel)
-        self.max_start_v2 = min(
-            R * self.accel, R * prev_move.accel,
-            move_centripetal_v2, prev_move_centripetal_v2,
-            extruder_v2, self.max_cruise_v2, prev_move.max_cruise_v2,
-            prev_move.max_start_v2 + prev_move.delta_v2)
-        self.max_smoothed_v2 = min(
-            self.max_start_v2
-            , prev_move.max_smoothed_v2 + prev_move.smooth_delta_v2)
     def set_junction(self, start_v2, cruise_v2, end_v2):
         # Determine accel, cruise, and decel portions of the move distance
         inv_delta_v2 = 1. / self.delta_v2
@@ -94,100 +79,134 @@ class Move:
         self.accel_t = accel_r * self.move_d / ((start_v + cruise_v) * 0.5)
         self.cruise_t = cruise_r * self.move_d / cruise_v
         self.decel_t = decel_r * self.move_d / ((end_v + cruise_v) * 0.5)
-    def move(self):
-        # Generate step times for the move
-        next_move_time = self.toolhead.get_next_move_time()
+    def fill_cmove(self, cmove, print_time):
+        # Fill the velocity trapezoid of the kinematic move (the caller
+        # generates its steps) and generate the extruder steps
         if self.is_kinematic_move:
             self.toolhead.move_fill(
-                self.cmove, next_move_time,
+                cmove, print_time,
                 self.accel_t, self.cruise_t, self.decel_t,
                 self.start_pos[0], self.start_pos[1], self.start_pos[2],
                 self.axes_d[0], self.axes_d[1], self.axes_d[2],
                 self.start_v, self.cruise_v, self.accel)
-            self.toolhead.kin.move(next_move_time, self)
         if self.axes_d[3]:
-            self.toolhead.extruder.move(next_move_time, self)
-        self.toolhead.update_move_time(
-            self.accel_t + self.cruise_t + self.decel_t)
+            self.toolhead.extruder.move(print_time, self)
+        return self.accel_t + self.cruise_t + self.decel_t
+    def move(self):
+        # Generate step times for the move
+        next_move_time = self.toolhead.get_next_move_time()
+        move_t = self.fill_cmove(self.cmove, next_move_time)
+        if self.is_kinematic_move:
+            self.toolhead.kin.move(next_move_time, self)
+        self.toolhead.update_move_time(move_t)
 
 LOOKAHEAD_FLUSH_TIME = 0.250
+LOOKAHEAD_MIN_FLUSH_TIME = 0.050
+LOOKAHEAD_MAX_FLUSH_TIME = 1.000
+LOOKAHEAD_TINY_MOVES = 200
+LOOKAHEAD_MAX_LOAD = 0.25
+MOVE_BATCH_SIZE = 64
 
 # Class to track a list of pending move requests and to facilitate
 # "look-ahead" across moves to reduce acceleration between moves.
 class MoveQueue:
-    def __init__(self):
+    def __init__(self, toolhead):
+        self.toolhead = toolhead
         self.extruder_lookahead = None
         self.queue = []
         self.leftover = 0
         self.junction_flush = LOOKAHEAD_FLUSH_TIME
+        # Adaptive lazy flush window
+        self.flush_time = LOOKAHEAD_FLUSH_TIME
+        self.buffer_margin = None
+        self.last_flush_duration = 0.
+        self.last_flush_moves = 0
+        # Junction speed planning state (see chelper/lookahead.c)
+        self.ffi_main, ffi_lib = chelper.get_ffi()
+        self.get_monotonic = ffi_lib.get_monotonic
+        self.clookahead = self.ffi_main.gc(ffi_lib.lookahead_alloc(),
+                                      ffi_lib.lookahead_free)
+        self.lookahead_add = ffi_lib.lookahead_add
+        self.lookahead_flush = ffi_lib.lookahead_flush
+        self.lookahead_get_moves = ffi_lib.lookahead_get_moves
+        self.lookahead_pop = ffi_lib.lookahead_pop
+        self.lookahead_reset = ffi_lib.lookahead_reset
     def reset(self):
         del self.queue[:]
+        self.lookahead_reset(self.clookahead)
         self.leftover = 0
-        self.junction_flush = LOOKAHEAD_FLUSH_TIME
+        self.junction_flush = self.flush_time = LOOKAHEAD_FLUSH_TIME
+        self.buffer_margin = None
     def set_flush_time(self, flush_time):
         self.junction_flush = flush_time
+    def note_buffer_margin(self, margin):
+        # The toolhead reports the buffered print time above its low
+        # water mark - flush sooner if the buffer is running dry
+        self.buffer_margin = margin
+        if margin < self.flush_time:
+            self.flush_time = max(self.flush_time * .5,
+                                  LOOKAHEAD_MIN_FLUSH_TIME)
+            self.junction_flush = min(self.junction_flush, self.flush_time)
+    def _adapt_flush_time(self, move_count, duration):
+        # Many small moves per window - use a larger window (to reduce
+        # per-flush overhead) if the host is keeping up
+        self.last_flush_duration = duration
+        self.last_flush_moves = move_count
+        margin = self.buffer_margin
+        if margin is not None and margin < 2. * self.flush_time:
+            return
+        if (move_count >= LOOKAHEAD_TINY_MOVES
+            and duration < LOOKAHEAD_MAX_LOAD * self.flush_time):
+            self.flush_time = min(self.flush_time * 1.25,
+                                  LOOKAHEAD_MAX_FLUSH_TIME)
+        elif self.flush_time < LOOKAHEAD_FLUSH_TIME:
+            self.flush_time = min(self.flush_time * 1.25,
+                                  LOOKAHEAD_FLUSH_TIME)
     def set_extruder(self, extruder):
         self.extruder_lookahead = extruder.lookahead
     def flush(self, lazy=False):
-        self.junction_flush = LOOKAHEAD_FLUSH_TIME
-        update_flush_count = lazy
+        self.junction_flush = self.flush_time
+        flush_start = self.get_monotonic()
         queue = self.queue
-        flush_count = len(queue)
         # Traverse queue from last to first move and determine maximum
         # junction speed assuming the robot comes to a complete stop
         # after the last move.
-        delayed = []
-        next_end_v2 = next_smoothed_v2 = peak_cruise_v2 = 0.
-        for i in range(flush_count-1, self.leftover-1, -1):
-            move = queue[i]
-            reachable_start_v2 = next_end_v2 + move.delta_v2
-            start_v2 = min(move.max_start_v2, reachable_start_v2)
-            reachable_smoothed_v2 = next_smoothed_v2 + move.smooth_delta_v2
-            smoothed_v2 = min(move.max_smoothed_v2, reachable_smoothed_v2)
-            if smoothed_v2 < reachable_smoothed_v2:
-                # It's possible for this move to accelerate
-                if (smoothed_v2 + move.smooth_delta_v2 > next_smoothed_v2
-                    or delayed):
-                    # This move can decelerate or this is a full accel
-                    # move after a full decel move
-                    if update_flush_count and peak_cruise_v2:
-                        flush_count = i
-                        update_flush_count = False
-                    peak_cruise_v2 = min(move.max_cruise_v2, (
-                        smoothed_v2 + reachable_smoothed_v2) * .5)
-                    if delayed:
-                        # Propagate peak_cruise_v2 to any delayed moves
-                        if not update_flush_count and i < flush_count:
-                            for m, ms_v2, me_v2 in delayed:
-                                mc_v2 = min(peak_cruise_v2, ms_v2)
-                                m.set_junction(min(ms_v2, mc_v2), mc_v2
-                                               , min(me_v2, mc_v2))
-                        del delayed[:]
-                if not update_flush_count and i < flush_count:
-                    cruise_v2 = min((start_v2 + reachable_start_v2) * .5
-                                    , move.max_cruise_v2, peak_cruise_v2)
-                    move.set_junction(min(start_v2, cruise_v2), cruise_v2
-                                      , min(next_end_v2, cruise_v2))
-            else:
-                # Delay calculating this move until peak_cruise_v2 is known
-                delayed.append((move, start_v2, next_end_v2))
-            next_end_v2 = start_v2
-            next_smoothed_v2 = smoothed_v2
-        if update_flush_count:
+        flush_count = self.lookahead_flush(self.clookahead, self.leftover,
+                                           lazy)
+        if flush_count < 0:
             return
+        lookahead_moves = self.lookahead_get_moves(self.clookahead)
+        for i in range(self.leftover, flush_count):
+            lm = lookahead_moves[i]
+            queue[i].set_junction(lm.start_v2, lm.cruise_v2, lm.end_v2)
         # Allow extruder to do its lookahead
         move_count = self.extruder_lookahead(queue, flush_count, lazy)
         # Generate step times for all moves ready to be flushed
-        for move in queue[:move_count]:
-            move.move()
+        if move_count:
+            self.toolhead._process_moves(queue[:move_count])
         # Remove processed moves from the queue
         self.leftover = flush_count - move_count
         del queue[:move_count]
+        self.lookahead_pop(self.clookahead, move_count)
+        if lazy:
+            self._adapt_flush_time(move_count,
+                                   self.get_monotonic() - flush_start)
     def add_move(self, move):
         self.queue.append(move)
+        # Calculate maximum junction speed with previous move
+        axes_d = move.axes_d
+        lm = self.lookahead_add(
+            self.clookahead, axes_d[0], axes_d[1], axes_d[2], axes_d[3],
+            move.move_d, move.accel, move.extrude_r, move.is_kinematic_move,
+            move.max_cruise_v2, move.delta_v2, move.smooth_delta_v2,
+            move.toolhead.junction_deviation)
+        if lm == self.ffi_main.NULL:
+            raise mcu.error("Internal error in lookahead")
+        move.max_start_v2 = lm.max_start_v2
+        move.max_smoothed_v2 = lm.max_smoothed_v2
+        move.extrude_r = lm.extrude_r
         if len(self.queue) == 1:
             return
-        move.calc_junction(self.queue[-2])
         self.junction_flush -= move.min_move_t
         if self.junction_flush <= 0.:
             # Enough moves have been queued to reach the target flush time.
@@ -203,10 +222,12 @@ class ToolHead:
         self.all_mcus = [
             m for n, m in self.printer.lookup_objects(module='mcu')]
         self.mcu = self.all_mcus[0]
-        self.move_queue = MoveQueue()
+        self.move_queue = MoveQueue(self)
         self.commanded_pos = [0., 0., 0., 0.]
         self.printer.register_event_handler("klippy:shutdown",
                                             self._handle_shutdown)
+        self.printer.register_event_handler("klippy:disconnect",
+                                            self._handle_disconnect)
         # Velocity and acceleration control
         self.max_velocity = config.getfloat('max_velocity', above=0.)
         self.max_accel = config.getfloat('max_accel', above=0.)
@@ -219,6 +240,7 @@ class ToolHead:
         self.config_max_accel = self.max_accel
         self.config_square_corner_velocity = self.square_corner_velocity
         self.junction_deviation = 0.
+        self.move_trace = None
         self._calc_junction_deviation()
         # Print time tracking
         self.buffer_time_low = config.getfloat(
@@ -244,10 +266,18 @@ class ToolHead:
         ffi_main, ffi_lib = chelper.get_ffi()
         self.cmove = ffi_main.gc(ffi_lib.move_alloc(), ffi_lib.free)
         self.move_fill = ffi_lib.move_fill
+        self.batch_cmoves = [ffi_main.gc(ffi_lib.move_alloc(), ffi_lib.free)
+                             for i in range(MOVE_BATCH_SIZE)]
+        self.batch_cmove_array = ffi_main.new('struct move *[]',
+                                              self.batch_cmoves)
+        self.batch_sk_list = None
+        self.batch_sk_array = None
+        self.ffi_main = ffi_main
+        self.itersolve_gen_steps_batch = ffi_lib.itersolve_gen_steps_batch
         # Create kinematics class
         self.extruder = kinematics.extruder.DummyExtruder()
         self.move_queue.set_extruder(self.extruder)
-        kin_name = config.get('kinematics')
+        self.kin_name = kin_name = config.get('kinematics')
         try:
             mod = importlib.import_module('kinematics.' + kin_name)
             self.kin = mod.load_kinematics(self, config)
@@ -264,12 +294,15 @@ class ToolHead:
         gcode.register_command('SET_VELOCITY_LIMIT', self.cmd_SET_VELOCITY_LIMIT,
                                desc=self.cmd_SET_VELOCITY_LIMIT_help)
         gcode.register_command('M204', self.cmd_M204)
+        gcode.register_command('SET_MOVE_TRACE', self.cmd_SET_MOVE_TRACE,
+                               desc=self.cmd_SET_MOVE_TRACE_help)
     # Print time tracking
     def update_move_time(self, movetime):
-        self.print_time += movetime
-        flush_to_time = self.print_time - self.move_flush_time
-        for m in self.all_mcus:
-            m.flush_moves(flush_to_time)
+        self._update_print_time(self.print_time + movetime)
+    def _update_print_time(self, next_print_time):
+        self.print_time = next_print_time
+        flush_to_time = next_print_time - self.move_flush_time
+        mcu.flush_all_moves(self.all_mcus, flush_to_time)
     def _calc_print_time(self):
         curtime = self.reactor.monotonic()
         est_print_time = self.mcu.estimated_print_time(curtime)
@@ -284,7 +317,42 @@ class ToolHead:
             self.reactor.update_timer(self.flush_timer, self.reactor.NOW)
             self._calc_print_time()
         return self.print_time
+    # Step generation
+    def _process_moves(self, moves):
+        for i in range(0, len(moves), MOVE_BATCH_SIZE):
+            self._process_move_batch(moves[i:i+MOVE_BATCH_SIZE])
+    def _process_move_batch(self, moves):
+        steppers = self.kin.get_steppers()
+        if not all([s.is_motor_enabled() for s in steppers]):
+            # Let the kinematics enable the motors
+            for move in moves:
+                move.move()
+            return
+        # Fill the velocity trapezoid of each kinematic move
+        next_move_time = self.get_next_move_time()
+        batch_cmoves = self.batch_cmoves
+        count = 0
+        for move in moves:
+            next_move_time += move.fill_cmove(batch_cmoves[count],
+                                              next_move_time)
+            if move.is_kinematic_move:
+                count += 1
+        # Generate the steps of each stepper for all the moves
+        sk_list = [s.mcu_stepper.get_active_kinematics() for s in steppers]
+        if sk_list != self.batch_sk_list:
+            self.batch_sk_list = sk_list
+            self.batch_sk_array = self.ffi_main.new(
+                'struct stepper_kinematics *[]',
+                [sk for sk in sk_list if sk is not None])
+        ret = self.itersolve_gen_steps_batch(
+            self.batch_sk_array, len(self.batch_sk_array),
+            self.batch_cmove_array, count)
+        if ret:
+            raise mcu.error("Internal error in stepcompress")
+        self._update_print_time(next_move_time)
     def _flush_lookahead(self, must_sync=False):
+        if self.move_trace is not None:
+            self.move_trace.record_flush()
         sync_print_time = self.sync_print_time
         self.move_queue.flush()
         self.idle_flush_print_time = 0.
@@ -293,8 +361,7 @@ class ToolHead:
             self.move_queue.set_flush_time(self.buffer_time_high)
             self.need_check_stall = -1.
             self.reactor.update_timer(self.flush_timer, self.reactor.NEVER)
-            for m in self.all_mcus:
-                m.flush_moves(self.print_time)
+            mcu.flush_all_moves(self.all_mcus, self.print_time)
     def get_last_move_time(self):
         self._flush_lookahead()
         if self.sync_print_time:
@@ -331,6 +398,8 @@ class ToolHead:
         try:
             print_time = self.print_time
             buffer_time = print_time - self.mcu.estimated_print_time(eventtime)
+            self.move_queue.note_buffer_margin(
+                buffer_time - self.buffer_time_low)
             if buffer_time > self.buffer_time_low:
                 # Running normally - reschedule check
                 return eventtime + buffer_time - self.buffer_time_low
@@ -347,9 +416,13 @@ class ToolHead:
         return list(self.commanded_pos)
     def set_position(self, newpos, homing_axes=()):
         self._flush_lookahead()
+        if self.move_trace is not None:
+            self.move_trace.record_position(newpos)
         self.commanded_pos[:] = newpos
         self.kin.set_position(newpos, homing_axes)
     def move(self, newpos, speed):
+        if self.move_trace is not None:
+            self.move_trace.record_move(newpos, speed)
         move = Move(self, self.commanded_pos, newpos, speed)
         if not move.move_d:
             return
@@ -361,8 +434,30 @@ class ToolHead:
         self.move_queue.add_move(move)
         if self.print_time > self.need_check_stall:
             self._check_stall()
+    def move_batch(self, moves):
+        # Queue a sequence of (newpos, speed) moves
+        if self.move_trace is not None:
+            moves = self.move_trace.record_moves(moves)
+        commanded_pos = self.commanded_pos
+        add_move = self.move_queue.add_move
+        kin, extruder = self.kin, self.extruder
+        for newpos, speed in moves:
+            move = Move(self, commanded_pos, newpos, speed)
+            if not move.move_d:
+                continue
+            if move.is_kinematic_move:
+                kin.check_move(move)
+            if move.axes_d[3]:
+                extruder.check_move(move)
+            commanded_pos[:] = move.end_pos
+            add_move(move)
+            if self.print_time > self.need_check_stall:
+                self._check_stall()
+                kin, extruder = self.kin, self.extruder
     def dwell(self, delay, check_stall=True):
         self.get_last_move_time()
+        if self.move_trace is not None:
+            self.move_trace.record_dwell(delay)
         self.update_move_time(delay)
         if check_stall:
             self._check_stall()
@@ -398,8 +493,12 @@ class ToolHead:
             m.check_active(self.print_time, eventtime)
         buffer_time = self.print_time - self.mcu.estimated_print_time(eventtime)
         is_active = buffer_time > -60. or not self.sync_print_time
-        return is_active, "print_time=%.3f buffer_time=%.3f print_stall=%d" % (
-            self.print_time, max(buffer_time, 0.), self.print_stall)
+        mq = self.move_queue
+        return is_active, (
+            "print_time=%.3f buffer_time=%.3f print_stall=%d"
+            " lookahead_flush_time=%.3f lookahead_flush_duration=%.6f" % (
+                self.print_time, max(buffer_time, 0.), self.print_stall,
+                mq.flush_time, mq.last_flush_duration))
     def check_busy(self, eventtime):
         est_print_time = self.mcu.estimated_print_time(eventtime)
         lookahead_empty = not self.move_queue.queue
@@ -415,10 +514,18 @@ class ToolHead:
             status = "Ready"
         return { 'status': status, 'print_time': print_time,
                  'estimated_print_time': estimated_print_time,
-                 'printing_time': print_time - last_print_start_time }
+                 'printing_time': print_time - last_print_start_time,
+                 'lookahead_flush_time': self.move_queue.flush_time,
+                 'lookahead_flush_duration':
+                 self.move_queue.last_flush_duration,
+                 'lookahead_flush_moves': self.move_queue.last_flush_moves }
     def _handle_shutdown(self):
         self.move_queue.reset()
         self.reset_print_time()
+    def _handle_disconnect(self):
+        if self.move_trace is not None:
+            self.move_trace.close()
+            self.move_trace = None
     def get_kinematics(self):
         return self.kin
     def get_max_velocity(self):
@@ -434,6 +541,10 @@ class ToolHead:
         self.junction_deviation = scv2 * (math.sqrt(2.) - 1.) / self.max_accel
         self.max_accel_to_decel = min(self.requested_accel_to_decel,
                                       self.max_accel)
+        if self.move_trace is not None:
+            self.move_trace.note_limits(
+                self.max_velocity, self.max_accel, self.max_accel_to_decel,
+                self.junction_deviation)
     cmd_SET_VELOCITY_LIMIT_help = "Set printer velocity limits"
     def cmd_SET_VELOCITY_LIMIT(self, params):
         print_time = self.get_last_move_time()
@@ -470,6 +581,34 @@ class ToolHead:
             accel = gcode.get_float('S', params, above=0.)
         self.max_accel = min(accel, self.config_max_accel)
         self._calc_junction_deviation()
+    cmd_SET_MOVE_TRACE_help = "Record toolhead moves to a file"
+    def cmd_SET_MOVE_TRACE(self, params):
+        gcode = self.printer.lookup_object('gcode')
+        filename = gcode.get_str('FILENAME', params, None)
+        self._flush_lookahead()
+        if self.move_trace is not None:
+            self.move_trace.close()
+            self.move_trace = None
+            gcode.respond_info("Move trace stopped")
+        if filename is None:
+            return
+        steppers = [(s.get_name(), s.get_step_dist())
+                    for s in self.kin.get_steppers()]
+        extruder_stepper = getattr(self.extruder, 'stepper', None)
+        if extruder_stepper is not None:
+            steppers.append(('extruder', extruder_stepper.get_step_dist()))
+        try:
+            move_trace = movetrace.MoveTraceWriter(
+                filename, self.kin_name, steppers)
+        except IOError as e:
+            raise gcode.error("Unable to open move trace file: %s" % (
+                str(e),))
+        move_trace.record_position(self.commanded_pos)
+        move_trace.note_limits(self.max_velocity, self.max_accel,
+                               self.max_accel_to_decel,
+                               self.junction_deviation)
+        self.move_trace = move_trace
+        gcode.respond_info("Recording moves to %s" % (filename,))
 
 def add_printer_objects(config):
     config.get_printer().add_object('toolhead', ToolHead(config))
@@ -0,0 +1,79 @@
+#!/usr/bin/env python2
+# Benchmark the g-code parser command throughput
+#
+# Copyright (C) 2018  Kevin O'Connor <kevin@koconnor.net>
+#
+# This file may be distributed under the terms of the GNU GPLv3 license.
+import sys, os, optparse, time
+sys.path.append(os.path.join(os.path.dirname(__file__), '../klippy'))
+import gcode
+
+DEFAULT_GCODE = os.path.join(os.path.dirname(__file__),
+                             '../test/klippy/move.gcode')
+
+# Minimal printer object - just enough to instantiate a GCodeParser
+class BenchPrinter:
+    config_error = Exception
+    def register_event_handler(self, event, callback):
+        pass
+    def get_reactor(self):
+        return None
+    def get_start_args(self):
+        return {'debuginput': 'bench'}
+
+def setup_parser():
+    gc = gcode.GCodeParser(BenchPrinter(), None)
+    # Route moves to a sink and make all other commands no-ops so
+    # that only parsing and dispatch are measured.
+    def noop(params):
+        pass
+    for cmd in gc.ready_gcode_handlers:
+        if cmd not in ('G0', 'G1'):
+            gc.ready_gcode_handlers[cmd] = noop
+    gc.cmd_default = noop
+    gc.move_with_transform = (lambda pos, speed: None)
+    def move_batch(moves):
+        for pos, speed in moves:
+            pass
+    gc.move_batch = move_batch
+    gc.is_printer_ready = True
+    gc.gcode_handlers = gc.ready_gcode_handlers
+    return gc
+
+def main():
+    usage = "%prog [options] [gcode file]"
+    opts = optparse.OptionParser(usage)
+    opts.add_option("-n", "--lines", type="int", dest="lines", default=500000,
+                    help="minimum number of lines to process per run")
+    opts.add_option("-c", "--chunk", type="int", dest="chunk", default=100,
+                    help="number of lines passed per process_commands call")
+    opts.add_option("-r", "--repeat", type="int", dest="repeat", default=5,
+                    help="number of timed runs")
+    options, args = opts.parse_args()
+    if len(args) > 1:
+        opts.error("Incorrect number of arguments")
+    filename = DEFAULT_GCODE
+    if args:
+        filename = args[0]
+    f = open(filename, 'rb')
+    lines = f.read().split('\n')
+    f.close()
+    commands = lines * max(1, options.lines // len(lines))
+    chunks = [commands[i:i+options.chunk]
+              for i in range(0, len(commands), options.chunk)]
+    gc = setup_parser()
+    best = None
+    for i in range(options.repeat):
+        gc.last_position = [0., 0., 0., 0.]
+        starttime = time.time()
+        for chunk in chunks:
+            gc.process_commands(chunk, need_ack=False)
+        runtime = time.time() - starttime
+        if best is None or runtime < best:
+            best = runtime
+    print "%s: %d lines in %.3fs (best of %d) - %.0f lines/sec" % (
+        os.path.basename(filename), len(commands), best, options.repeat,
+        len(commands) / best)
+
+if __name__ == '__main__':
+    main()
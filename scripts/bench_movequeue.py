@@ -0,0 +1,108 @@
+#!/usr/bin/env python2
+# Benchmark memory and time used by the toolhead look-ahead queue
+#
+# Copyright (C) 2018  Kevin O'Connor <kevin@koconnor.net>
+#
+# This file may be distributed under the terms of the GNU GPLv3 license.
+import sys, os, optparse, time, math, gc
+sys.path.append(os.path.join(os.path.dirname(__file__), '../klippy'))
+import chelper, toolhead
+
+# Toolhead stand-in - provides the limits used by Move() and discards
+# the generated moves
+class BenchToolHead:
+    def __init__(self):
+        self.max_velocity = 300.
+        self.max_accel = 3000.
+        self.max_accel_to_decel = 1500.
+        self.junction_deviation = 5.**2 * (math.sqrt(2.) - 1.) / 3000.
+        ffi_main, ffi_lib = chelper.get_ffi()
+        self.cmove = ffi_main.gc(ffi_lib.move_alloc(), ffi_lib.free)
+        self.move_fill = ffi_lib.move_fill
+        self.extruder = BenchExtruder()
+        self.kin = self
+        self.print_time = 0.
+    def get_next_move_time(self):
+        return self.print_time
+    def update_move_time(self, movetime):
+        self.print_time += movetime
+    def move(self, print_time, move):
+        pass
+    def _process_moves(self, moves):
+        for move in moves:
+            move.move()
+
+class BenchExtruder:
+    def lookahead(self, moves, flush_count, lazy):
+        return flush_count
+    def move(self, print_time, move):
+        pass
+
+def get_rss():
+    # Return the resident memory of this process (in bytes)
+    f = open('/proc/self/statm', 'rb')
+    data = f.read()
+    f.close()
+    return int(data.split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+def gen_positions(count, seg_len):
+    # Short segments around a circle (similar to arc-approximated paths)
+    radius = seg_len * count / (2. * math.pi * 10.)
+    out = []
+    for i in range(count + 1):
+        angle = 2. * math.pi * 10. * i / count
+        out.append((radius * math.cos(angle), radius * math.sin(angle),
+                    0., 0.))
+    return out
+
+def main():
+    usage = "%prog [options]"
+    opts = optparse.OptionParser(usage)
+    opts.add_option("-n", "--moves", type="int", dest="moves", default=100000,
+                    help="number of moves to queue")
+    opts.add_option("-s", "--segment", type="float", dest="segment",
+                    default=0.2, help="segment length (in mm)")
+    opts.add_option("-l", "--lazy", action="store_true", dest="lazy",
+                    help="time queuing with the normal lazy flushing")
+    options, args = opts.parse_args()
+    if args:
+        opts.error("Incorrect number of arguments")
+    th = BenchToolHead()
+    positions = gen_positions(options.moves, options.segment)
+    mq = toolhead.MoveQueue(th)
+    mq.set_extruder(th.extruder)
+    if options.lazy:
+        # Queue and flush all moves as the toolhead would
+        starttime = time.time()
+        for i in range(options.moves):
+            move = toolhead.Move(th, positions[i], positions[i+1], 100.)
+            mq.add_move(move)
+        mq.flush()
+        run_time = time.time() - starttime
+        print "Queued and flushed %d moves in %.3fs (%.3fus/move)" % (
+            options.moves, run_time, run_time * 1000000. / options.moves)
+        return
+    # Queue all moves without allowing a lazy flush
+    gc.collect()
+    start_rss = get_rss()
+    starttime = time.time()
+    mq.set_flush_time(999999999.9)
+    for i in range(options.moves):
+        move = toolhead.Move(th, positions[i], positions[i+1], 100.)
+        mq.add_move(move)
+    queue_time = time.time() - starttime
+    gc.collect()
+    queue_rss = get_rss() - start_rss
+    # Flush the queue
+    starttime = time.time()
+    mq.flush()
+    flush_time = time.time() - starttime
+    print "Queued %d moves in %.3fs (%.3fus/move)" % (
+        options.moves, queue_time, queue_time * 1000000. / options.moves)
+    print "Queue memory %.1fMiB (%.0f bytes/move)" % (
+        queue_rss / (1024. * 1024.), float(queue_rss) / options.moves)
+    print "Flushed %d moves in %.3fs (%.3fus/move)" % (
+        options.moves, flush_time, flush_time * 1000000. / options.moves)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,349 @@
+#!/usr/bin/env python2
+# Benchmark step generation and step compression for each kinematics
+#
+# Copyright (C) 2018  Kevin O'Connor <kevin@koconnor.net>
+#
+# This file may be distributed under the terms of the GNU GPLv3 license.
+import sys, os, optparse, time, math
+sys.path.append(os.path.join(os.path.dirname(__file__), '../klippy'))
+import chelper
+
+MCU_FREQ = 16000000.
+MAX_STEP_ERROR = .000025
+MOVE_BATCH_SIZE = 64
+MOVE_BATCH_TIME = .250
+MCU_MOVE_COUNT = 500
+QUEUE_STEP_MSGID, SET_NEXT_STEP_DIR_MSGID = 1, 2
+
+DELTA_RADIUS = 174.75
+DELTA_ARM = 333.
+WINCH_ANCHORS = [(0., -2000., -100.), (2000., 1000., -100.),
+                 (-2000., 1000., -100.), (0., 0., 3000.)]
+
+def delta_steppers():
+    out = []
+    for name, angle in zip('abc', [210., 330., 90.]):
+        tower_x = math.cos(math.radians(angle)) * DELTA_RADIUS
+        tower_y = math.sin(math.radians(angle)) * DELTA_RADIUS
+        out.append((name, 'delta_stepper_alloc',
+                    (DELTA_ARM**2, tower_x, tower_y), .01))
+    return out
+
+# Each kinematics: (path center, list of steppers).  Each stepper is
+# described with (name, alloc function, alloc args, step_distance).
+KINEMATICS = {
+    'cartesian': ((0., 0.), [
+        ('x', 'cartesian_stepper_alloc', ('x',), .0125),
+        ('y', 'cartesian_stepper_alloc', ('y',), .0125),
+        ('z', 'cartesian_stepper_alloc', ('z',), .0025)]),
+    'corexy': ((0., 0.), [
+        ('a', 'corexy_stepper_alloc', ('+',), .0125),
+        ('b', 'corexy_stepper_alloc', ('-',), .0125),
+        ('z', 'cartesian_stepper_alloc', ('z',), .0025)]),
+    'markforged': ((0., 0.), [
+        ('a', 'markforged_stepper_alloc', ('a',), .0125),
+        ('b', 'markforged_stepper_alloc', ('b',), .0125),
+        ('z', 'cartesian_stepper_alloc', ('z',), .0025)]),
+    'delta': ((0., 0.), delta_steppers()),
+    'polar': ((0., 100.), [
+        ('bed', 'polar_stepper_alloc', ('a',), .000981748),
+        ('arm', 'polar_stepper_alloc', ('r',), .01),
+        ('z', 'cartesian_stepper_alloc', ('z',), .0025)]),
+    'winch': ((0., 0.), [
+        ('abcd'[i], 'winch_stepper_alloc', a, .01)
+        for i, a in enumerate(WINCH_ANCHORS)]),
+    'extruder': ((0., 0.), [
+        ('e', 'extruder_stepper_alloc', (), .0022)]),
+}
+
+
+######################################################################
+# Synthetic move generation
+######################################################################
+
+# Zig-zag infill lines with a layer change after each layer
+def gen_infill(size, spacing, layers):
+    out = []
+    z = .2
+    for layer in range(layers):
+        y = -size / 2.
+        out.append(((-size / 2., y, z), False))
+        i = 0
+        while y <= size / 2.:
+            x = size / 2. if i & 1 == layer & 1 else -size / 2.
+            out.append(((x, y, z), True))
+            y += spacing
+            i += 1
+            out.append(((x, y, z), True))
+        z += .2
+    return out
+
+# Circles made of short segments (similar to arc-approximated paths)
+def gen_circles(radius, seg_len, layers):
+    out = []
+    count = int(2. * math.pi * radius / seg_len)
+    z = .2
+    for layer in range(layers):
+        out.append(((radius, 0., z), False))
+        for i in range(1, count + 1):
+            angle = 2. * math.pi * i / count
+            out.append(((radius * math.cos(angle), radius * math.sin(angle),
+                         z), True))
+        z += .2
+    return out
+
+PATTERNS = {
+    'infill': (lambda layers: gen_infill(50., .5, layers)),
+    'circles': (lambda layers: gen_circles(40., .5, layers)),
+}
+
+# Plan the velocity of each move - returns a list of (start_pos,
+# axes_d, extrude_d, start_v, cruise_v, end_v) tuples
+def plan_moves(path, velocity, accel, extrude_ratio):
+    moves = []
+    last_pos, last_axes_r = path[0][0], None
+    for pos, is_extrude in path[1:]:
+        axes_d = [pos[i] - last_pos[i] for i in range(3)]
+        move_d = math.sqrt(sum([d*d for d in axes_d]))
+        if not move_d:
+            continue
+        axes_r = [d / move_d for d in axes_d]
+        # Only allow a junction speed on nearly straight junctions
+        junction_v = 0.
+        if last_axes_r is not None:
+            cos_theta = sum([a*b for a, b in zip(axes_r, last_axes_r)])
+            if cos_theta > .99:
+                junction_v = velocity
+        if moves:
+            moves[-1][5] = junction_v
+        extrude_d = move_d * extrude_ratio if is_extrude else 0.
+        moves.append([last_pos, axes_d, extrude_d, junction_v, velocity, 0.])
+        last_pos, last_axes_r = pos, axes_r
+    # Limit junction speeds to what is reachable with the acceleration
+    for i in range(len(moves)):
+        move_d = math.sqrt(sum([d*d for d in moves[i][1]]))
+        max_end_v = math.sqrt(moves[i][3]**2 + 2. * accel * move_d)
+        moves[i][5] = min(moves[i][5], max_end_v)
+        if i + 1 < len(moves):
+            moves[i+1][3] = moves[i][5]
+    for i in range(len(moves) - 1, -1, -1):
+        move_d = math.sqrt(sum([d*d for d in moves[i][1]]))
+        max_start_v = math.sqrt(moves[i][5]**2 + 2. * accel * move_d)
+        moves[i][3] = min(moves[i][3], max_start_v)
+        if i:
+            moves[i-1][5] = moves[i][3]
+    return [tuple(m) for m in moves]
+
+# Calculate the velocity trapezoid of a move
+def calc_trapezoid(move_d, start_v, cruise_v, end_v, accel):
+    cruise_v = min(cruise_v, math.sqrt(
+        .5 * (start_v**2 + end_v**2) + accel * move_d))
+    accel_d = (cruise_v**2 - start_v**2) / (2. * accel)
+    decel_d = (cruise_v**2 - end_v**2) / (2. * accel)
+    cruise_d = max(0., move_d - accel_d - decel_d)
+    accel_t = accel_d / ((start_v + cruise_v) * .5)
+    cruise_t = cruise_d / cruise_v
+    decel_t = decel_d / ((end_v + cruise_v) * .5)
+    return accel_t, cruise_t, decel_t, cruise_v
+
+# Fill a 'struct move' for each planned move
+def fill_moves(ffi_main, ffi_lib, kin_name, center, planned, accel,
+               pressure_advance):
+    cmoves = []
+    end_times = []
+    print_time = extrude_pos = nominal_pos = 0.
+    for start_pos, axes_d, extrude_d, start_v, cruise_v, end_v in planned:
+        move_d = math.sqrt(sum([d*d for d in axes_d]))
+        accel_t, cruise_t, decel_t, cruise_v = calc_trapezoid(
+            move_d, start_v, cruise_v, end_v, accel)
+        cmove = ffi_main.gc(ffi_lib.move_alloc(), ffi_lib.free)
+        if kin_name != 'extruder':
+            ffi_lib.move_fill(
+                cmove, print_time, accel_t, cruise_t, decel_t,
+                start_pos[0] + center[0], start_pos[1] + center[1],
+                start_pos[2], axes_d[0], axes_d[1], axes_d[2],
+                start_v, cruise_v, accel)
+        else:
+            # Simplified version of the extruder pressure advance
+            axis_r = extrude_d / move_d
+            extra_accel_v = extra_decel_v = 0.
+            prev_pressure_d = extrude_pos - nominal_pos
+            if extrude_d and pressure_advance:
+                if accel_t:
+                    npd = cruise_v * axis_r * pressure_advance
+                    extra_accel_d = npd - prev_pressure_d
+                    if extra_accel_d > 0.:
+                        extra_accel_v = extra_accel_d / accel_t
+                        prev_pressure_d += extra_accel_d
+                if decel_t and end_v < cruise_v:
+                    npd = end_v * axis_r * pressure_advance
+                    extra_decel_d = npd - prev_pressure_d
+                    if extra_decel_d < 0.:
+                        extra_decel_v = extra_decel_d / decel_t
+                        prev_pressure_d += extra_decel_d
+            ffi_lib.extruder_move_fill(
+                cmove, print_time, accel_t, cruise_t, decel_t, extrude_pos,
+                start_v * axis_r, cruise_v * axis_r, accel * axis_r,
+                extra_accel_v, extra_decel_v)
+            nominal_pos += extrude_d
+            extrude_pos = nominal_pos + prev_pressure_d
+        cmoves.append(cmove)
+        print_time += accel_t + cruise_t + decel_t
+        end_times.append(print_time)
+    start_pos = planned[0][0]
+    start_coord = (start_pos[0] + center[0], start_pos[1] + center[1],
+                   start_pos[2])
+    if kin_name == 'extruder':
+        start_coord = (0., 0., 0.)
+    return cmoves, end_times, start_coord
+
+
+######################################################################
+# Step generation
+######################################################################
+
+def parse_stats(stats):
+    return dict([p.split('=', 1) for p in stats.split()])
+
+# Wait for the serialqueue to discard all pending messages
+def wait_serialqueue(ffi_main, ffi_lib, serialqueue):
+    buf = ffi_main.new('char[4096]')
+    while 1:
+        ffi_lib.serialqueue_get_stats(serialqueue, buf, len(buf))
+        stats = parse_stats(ffi_main.string(buf))
+        if stats['ready_bytes'] == '0' and stats['stalled_bytes'] == '0':
+            return
+        time.sleep(.010)
+
+# Split the moves into batches (similar to the toolhead flushing)
+def calc_batches(end_times):
+    out = []
+    start = 0
+    batch_start_time = 0.
+    for i, end_time in enumerate(end_times):
+        if (i + 1 - start >= MOVE_BATCH_SIZE
+            or end_time >= batch_start_time + MOVE_BATCH_TIME
+            or i + 1 == len(end_times)):
+            out.append((start, i + 1 - start, end_time))
+            start = i + 1
+            batch_start_time = end_time
+    return out
+
+# Generate the steps of a list of moves - returns the time spent
+# generating steps, the time spent compressing steps, and the
+# stepcompress statistics
+def run_kinematics(ffi_main, ffi_lib, serialqueue, steppers,
+                   cmoves, end_times, start_coord):
+    sks = []
+    scs = []
+    for oid, (name, alloc_func, alloc_args, step_dist) in enumerate(steppers):
+        sc = ffi_main.gc(ffi_lib.stepcompress_alloc(oid),
+                         ffi_lib.stepcompress_free)
+        ffi_lib.stepcompress_fill(sc, int(MAX_STEP_ERROR * MCU_FREQ), 0,
+                                  QUEUE_STEP_MSGID, SET_NEXT_STEP_DIR_MSGID)
+        sk = ffi_main.gc(getattr(ffi_lib, alloc_func)(*alloc_args),
+                         ffi_lib.free)
+        ffi_lib.itersolve_set_stepcompress(sk, sc, step_dist)
+        # Start each stepper at its position for the first move
+        pos = ffi_lib.itersolve_calc_position_from_coord(sk, *start_coord)
+        ffi_lib.itersolve_set_commanded_pos(sk, pos)
+        sks.append(sk)
+        scs.append(sc)
+    ss = ffi_main.gc(ffi_lib.steppersync_alloc(serialqueue, scs, len(scs),
+                                               MCU_MOVE_COUNT),
+                     ffi_lib.steppersync_free)
+    ffi_lib.steppersync_set_time(ss, 0., MCU_FREQ)
+    move_array = ffi_main.new('struct move *[]', cmoves)
+    gen_time = compress_time = 0.
+    for i, count, end_time in calc_batches(end_times):
+        starttime = time.time()
+        for sk in sks:
+            ret = ffi_lib.itersolve_gen_steps_range(sk, move_array + i, count)
+            if ret:
+                raise Exception("Internal error in stepcompress")
+        midtime = time.time()
+        ret = ffi_lib.steppersync_flush(ss, int(end_time * MCU_FREQ))
+        if ret:
+            raise Exception("Internal error in stepcompress")
+        compress_time += time.time() - midtime
+        gen_time += midtime - starttime
+    stats = {}
+    buf = ffi_main.new('char[4096]')
+    for sc in scs:
+        ffi_lib.stepcompress_reset(sc, 0)
+        ffi_lib.stepcompress_get_stats(sc, buf, len(buf))
+        for k, v in parse_stats(ffi_main.string(buf)).items():
+            stats[k] = stats.get(k, 0) + int(v)
+    wait_serialqueue(ffi_main, ffi_lib, serialqueue)
+    return gen_time, compress_time, stats
+
+def main():
+    usage = "%prog [options]"
+    opts = optparse.OptionParser(usage)
+    opts.add_option("-k", "--kinematics", type="string", dest="kinematics",
+                    default=','.join(sorted(KINEMATICS.keys())),
+                    help="comma separated list of kinematics to benchmark")
+    opts.add_option("-p", "--pattern", type="string", dest="pattern",
+                    default=','.join(sorted(PATTERNS.keys())),
+                    help="comma separated list of move patterns")
+    opts.add_option("-l", "--layers", type="int", dest="layers", default=10,
+                    help="number of layers in each move pattern")
+    opts.add_option("-v", "--velocity", type="float", dest="velocity",
+                    default=150., help="maximum velocity (in mm/s)")
+    opts.add_option("-a", "--accel", type="float", dest="accel",
+                    default=3000., help="acceleration (in mm/s^2)")
+    opts.add_option("--pressure-advance", type="float",
+                    dest="pressure_advance", default=.05,
+                    help="extruder pressure advance")
+    opts.add_option("-r", "--repeat", type="int", dest="repeat", default=3,
+                    help="number of timed runs (the best run is reported)")
+    options, args = opts.parse_args()
+    if args:
+        opts.error("Incorrect number of arguments")
+    kin_names = options.kinematics.split(',')
+    pattern_names = options.pattern.split(',')
+    for name in kin_names:
+        if name not in KINEMATICS:
+            opts.error("Unknown kinematics '%s'" % (name,))
+    for name in pattern_names:
+        if name not in PATTERNS:
+            opts.error("Unknown move pattern '%s'" % (name,))
+    ffi_main, ffi_lib = chelper.get_ffi()
+    # Generated messages are encoded and discarded
+    devnull = open(os.devnull, 'wb')
+    serialqueue = ffi_lib.serialqueue_alloc(devnull.fileno(), 1)
+    ffi_lib.serialqueue_set_clock_est(
+        serialqueue, 1000000000000., ffi_lib.get_monotonic(), 0)
+    for pattern_name in pattern_names:
+        path = PATTERNS[pattern_name](options.layers)
+        planned = plan_moves(path, options.velocity, options.accel, .04)
+        for kin_name in kin_names:
+            center, steppers = KINEMATICS[kin_name]
+            cmoves, end_times, start_coord = fill_moves(
+                ffi_main, ffi_lib, kin_name, center, planned, options.accel,
+                options.pressure_advance)
+            best = None
+            for i in range(options.repeat):
+                res = run_kinematics(ffi_main, ffi_lib, serialqueue, steppers,
+                                     cmoves, end_times, start_coord)
+                if best is None or res[0] + res[1] < best[0] + best[1]:
+                    best = res
+            gen_time, compress_time, stats = best
+            steps = max(1, stats['steps'])
+            queue_steps = max(1, stats['queue_steps'])
+            print ("%-10s %-7s %d moves (%.1fs) %d steps:"
+                   " gen %.0fns/step (%.0f steps/sec)"
+                   " compress %.0fns/step"
+                   " %d queue_step (%.1f steps/msg, %.2f bytes/step)" % (
+                       kin_name, pattern_name, len(cmoves), end_times[-1],
+                       stats['steps'], gen_time * 1000000000. / steps,
+                       steps / max(gen_time, .000000001),
+                       compress_time * 1000000000. / steps,
+                       stats['queue_steps'], float(steps) / queue_steps,
+                       float(stats['queue_step_bytes']) / steps))
+    ffi_lib.serialqueue_exit(serialqueue)
+    ffi_lib.serialqueue_free(serialqueue)
+    devnull.close()
+
+if __name__ == '__main__':
+    main()
@@ -17,7 +17,7 @@ TASK_MAX=0.0025
 
 APPLY_PREFIX = [
     'mcu_awake', 'mcu_task_avg', 'mcu_task_stddev', 'bytes_write',
-    'bytes_read', 'bytes_retransmit', 'freq', 'adj',
+    'bytes_read', 'bytes_retransmit', 'freq', 'adj', 'rtt', 'clock_stddev',
     'target', 'temp', 'pwm'
 ]
 
@@ -0,0 +1,381 @@
+#!/usr/bin/env python2
+# Replay a toolhead move trace and report the host throughput
+#
+# Copyright (C) 2018  Kevin O'Connor <kevin@koconnor.net>
+#
+# This file may be distributed under the terms of the GNU GPLv3 license.
+import sys, os, optparse, time, json, tempfile
+sys.path.append(os.path.join(os.path.dirname(__file__), '../klippy'))
+import chelper, toolhead, movetrace, msgproto
+
+# Command ids used by the simulated micro-controller
+QUEUE_STEP_ID = 10
+SET_NEXT_STEP_DIR_ID = 11
+REPLAY_DICTIONARY = json.dumps({
+    'messages': {
+        QUEUE_STEP_ID: "queue_step oid=%c interval=%u count=%hu add=%hi",
+        SET_NEXT_STEP_DIR_ID: "set_next_step_dir oid=%c dir=%c" },
+    'commands': [QUEUE_STEP_ID, SET_NEXT_STEP_DIR_ID], 'responses': [] })
+
+# Stepper kinematics for each supported kinematics type
+KIN_STEPPERS = {
+    'cartesian': [('stepper_x', 'cartesian_stepper_alloc', 'x'),
+                  ('stepper_y', 'cartesian_stepper_alloc', 'y'),
+                  ('stepper_z', 'cartesian_stepper_alloc', 'z')],
+    'corexy': [('stepper_x', 'corexy_stepper_alloc', '+'),
+               ('stepper_y', 'corexy_stepper_alloc', '-'),
+               ('stepper_z', 'cartesian_stepper_alloc', 'z')],
+}
+
+class error(Exception):
+    pass
+
+# Track the time spent in each stage of the move pipeline
+class StageTimer:
+    def __init__(self):
+        self.stepgen_time = self.flush_time = 0.
+
+# A single micro-controller with a step compression queue per stepper
+class ReplayMCU:
+    def __init__(self, outfile, options):
+        self.ffi_main, self.ffi_lib = chelper.get_ffi()
+        self.mcu_freq = options.mcu_freq
+        self.max_error = int(options.max_error * self.mcu_freq)
+        self.serialqueue = self.ffi_lib.serialqueue_alloc(outfile.fileno(), 1)
+        self.ffi_lib.serialqueue_set_clock_est(
+            self.serialqueue, 1000000000000., self.ffi_lib.get_monotonic(), 0)
+        self.move_count = options.move_count
+        self.stepqueues = []
+        self.steppersync = None
+    def alloc_stepqueue(self, step_dist, sk):
+        ffi_main, ffi_lib = self.ffi_main, self.ffi_lib
+        sc = ffi_main.gc(ffi_lib.stepcompress_alloc(len(self.stepqueues)),
+                         ffi_lib.stepcompress_free)
+        ffi_lib.stepcompress_fill(sc, self.max_error, 0, QUEUE_STEP_ID,
+                                  SET_NEXT_STEP_DIR_ID)
+        sk = ffi_main.gc(sk, ffi_lib.free)
+        ffi_lib.itersolve_set_stepcompress(sk, sc, step_dist)
+        self.stepqueues.append(sc)
+        return sk
+    def setup_steppersync(self):
+        self.steppersync = self.ffi_lib.steppersync_alloc(
+            self.serialqueue, self.stepqueues, len(self.stepqueues),
+            self.move_count)
+        self.ffi_lib.steppersync_set_time(self.steppersync, 0., self.mcu_freq)
+    def flush_moves(self, print_time):
+        clock = int(print_time * self.mcu_freq)
+        if clock < 0:
+            return
+        ret = self.ffi_lib.steppersync_flush(self.steppersync, clock)
+        if ret:
+            raise error("Internal error in stepcompress")
+    def finish(self):
+        # Wait for the background thread to write all queued messages
+        stats_buf = self.ffi_main.new('char[4096]')
+        while 1:
+            self.ffi_lib.serialqueue_get_stats(
+                self.serialqueue, stats_buf, len(stats_buf))
+            stats = dict([s.split('=', 1) for s in
+                          self.ffi_main.string(stats_buf).split()])
+            if stats['ready_bytes'] == '0' and stats['stalled_bytes'] == '0':
+                break
+            time.sleep(0.010)
+        self.ffi_lib.steppersync_free(self.steppersync)
+        self.ffi_lib.serialqueue_exit(self.serialqueue)
+        self.ffi_lib.serialqueue_free(self.serialqueue)
+
+# Extruder without pressure advance
+class ReplayExtruder:
+    def __init__(self, mcu, step_dist):
+        ffi_main, ffi_lib = chelper.get_ffi()
+        self.sk = mcu.alloc_stepqueue(step_dist,
+                                      ffi_lib.extruder_stepper_alloc())
+        self.cmove = ffi_main.gc(ffi_lib.move_alloc(), ffi_lib.free)
+        self.extruder_move_fill = ffi_lib.extruder_move_fill
+        self.itersolve_gen_steps = ffi_lib.itersolve_gen_steps
+        self.extrude_pos = 0.
+    def lookahead(self, moves, flush_count, lazy):
+        return flush_count
+    def move(self, print_time, move):
+        axis_d = move.axes_d[3]
+        axis_r = axis_d / move.move_d
+        self.extruder_move_fill(
+            self.cmove, print_time, move.accel_t, move.cruise_t, move.decel_t,
+            self.extrude_pos, move.start_v * axis_r, move.cruise_v * axis_r,
+            move.accel * axis_r, 0., 0.)
+        ret = self.itersolve_gen_steps(self.sk, self.cmove)
+        if ret:
+            raise error("Internal error in stepcompress")
+        self.extrude_pos += axis_d
+
+# Toolhead stand-in that drives the real look-ahead queue and step
+# generation code
+class ReplayToolHead:
+    def __init__(self, info, mcu, timer, options):
+        ffi_main, ffi_lib = chelper.get_ffi()
+        kin_name = info.get('kinematics')
+        if kin_name not in KIN_STEPPERS:
+            raise error("Kinematics '%s' not supported" % (kin_name,))
+        self.steppers = []
+        for name, alloc_func, param in KIN_STEPPERS[kin_name]:
+            if name not in info:
+                raise error("Trace does not describe stepper %s" % (name,))
+            sk = getattr(ffi_lib, alloc_func)(param)
+            sk = mcu.alloc_stepqueue(float(info[name]), sk)
+            self.steppers.append(sk)
+        self.extruder = None
+        if 'extruder' in info:
+            self.extruder = ReplayExtruder(mcu, float(info['extruder']))
+        mcu.setup_steppersync()
+        self.mcu = mcu
+        self.timer = timer
+        self.sk_array = ffi_main.new('struct stepper_kinematics *[]',
+                                     self.steppers)
+        self.itersolve_gen_steps = ffi_lib.itersolve_gen_steps
+        self.itersolve_gen_steps_batch = ffi_lib.itersolve_gen_steps_batch
+        self.itersolve_calc_position_from_coord = (
+            ffi_lib.itersolve_calc_position_from_coord)
+        self.itersolve_set_commanded_pos = ffi_lib.itersolve_set_commanded_pos
+        self.cmoves = [ffi_main.gc(ffi_lib.move_alloc(), ffi_lib.free)
+                       for i in range(toolhead.MOVE_BATCH_SIZE)]
+        self.cmove_array = ffi_main.new('struct move *[]', self.cmoves)
+        self.cmove = self.cmoves[0]
+        self.move_fill = ffi_lib.move_fill
+        self.move_flush_time = options.move_flush_time
+        self.per_move = False
+        self.max_velocity = self.max_accel = 1.
+        self.max_accel_to_decel = 1.
+        self.junction_deviation = 0.
+        self.commanded_pos = [0., 0., 0., 0.]
+        self.print_time = 0.
+        self.move_queue = toolhead.MoveQueue(self)
+        if self.extruder is not None:
+            self.move_queue.set_extruder(self.extruder)
+        self.moves = 0
+    # Step generation (see ToolHead._process_move_batch() and Move.move())
+    def _process_moves(self, moves):
+        if self.per_move:
+            for move in moves:
+                self._process_move(move)
+            return
+        for i in range(0, len(moves), toolhead.MOVE_BATCH_SIZE):
+            self._process_move_batch(moves[i:i+toolhead.MOVE_BATCH_SIZE])
+    def _process_move(self, move):
+        starttime = time.time()
+        move_t = move.fill_cmove(self.cmove, self.print_time)
+        if move.is_kinematic_move:
+            for sk in self.steppers:
+                ret = self.itersolve_gen_steps(sk, self.cmove)
+                if ret:
+                    raise error("Internal error in stepcompress")
+        self.timer.stepgen_time += time.time() - starttime
+        self.print_time += move_t
+        self._flush_mcu(self.print_time - self.move_flush_time)
+    def _process_move_batch(self, moves):
+        starttime = time.time()
+        next_move_time = self.print_time
+        count = 0
+        for move in moves:
+            next_move_time += move.fill_cmove(self.cmoves[count],
+                                              next_move_time)
+            if move.is_kinematic_move:
+                count += 1
+        ret = self.itersolve_gen_steps_batch(
+            self.sk_array, len(self.sk_array), self.cmove_array, count)
+        if ret:
+            raise error("Internal error in stepcompress")
+        self.timer.stepgen_time += time.time() - starttime
+        self.print_time = next_move_time
+        self._flush_mcu(self.print_time - self.move_flush_time)
+    def _flush_mcu(self, print_time):
+        starttime = time.time()
+        self.mcu.flush_moves(print_time)
+        self.timer.flush_time += time.time() - starttime
+    # Trace record handlers
+    def add_move(self, newpos, speed):
+        move = toolhead.Move(self, self.commanded_pos, newpos, speed)
+        if not move.move_d:
+            return
+        if move.axes_d[3] and self.extruder is None:
+            raise error("Trace contains extrude moves but no extruder")
+        self.commanded_pos[:] = move.end_pos
+        self.move_queue.add_move(move)
+        self.moves += 1
+    def flush(self):
+        self.move_queue.flush()
+        self._flush_mcu(self.print_time)
+    def set_position(self, newpos):
+        self.flush()
+        self.commanded_pos[:] = newpos
+        for sk in self.steppers:
+            self.itersolve_set_commanded_pos(
+                sk, self.itersolve_calc_position_from_coord(
+                    sk, newpos[0], newpos[1], newpos[2]))
+        if self.extruder is not None:
+            self.extruder.extrude_pos = newpos[3]
+    def dwell(self, delay):
+        self.flush()
+        self.print_time += delay
+        self._flush_mcu(self.print_time - self.move_flush_time)
+    def set_limits(self, max_velocity, max_accel, max_accel_to_decel,
+                   junction_deviation):
+        self.max_velocity = max_velocity
+        self.max_accel = max_accel
+        self.max_accel_to_decel = max_accel_to_decel
+        self.junction_deviation = junction_deviation
+    def replay(self, records):
+        add_move = self.add_move
+        for rtype, values in records:
+            if rtype == 'M':
+                add_move(values[:4], values[4])
+            elif rtype == 'P':
+                self.set_position(values)
+            elif rtype == 'L':
+                self.set_limits(*values)
+            elif rtype == 'D':
+                self.dwell(values[0])
+            elif rtype == 'F':
+                self.flush()
+        self.flush()
+        self._flush_mcu(self.print_time + 1.)
+
+# Decode the simulated micro-controller output
+def read_messages(outfile):
+    mp = msgproto.MessageParser()
+    mp.process_identify(REPLAY_DICTIONARY, decompress=False)
+    outfile.seek(0)
+    reader = msgproto.PacketReader(mp, outfile)
+    for packet in reader:
+        pos = msgproto.MESSAGE_HEADER_SIZE
+        while pos < len(packet) - msgproto.MESSAGE_TRAILER_SIZE:
+            msgid = packet[pos]
+            params, pos = mp.messages_by_id[msgid].parse(packet, pos)
+            yield msgid, params
+    if reader.invalid_bytes:
+        raise error("Invalid data in replay output")
+
+def count_messages(outfile):
+    queue_steps = steps = 0
+    for msgid, params in read_messages(outfile):
+        if msgid == QUEUE_STEP_ID:
+            queue_steps += 1
+            steps += params['count']
+    return queue_steps, steps
+
+def decode_steps(outfile):
+    # Return the list of (clock, dir) step events of each stepper
+    steps = {}
+    last_clock = {}
+    next_dir = {}
+    for msgid, params in read_messages(outfile):
+        oid = params['oid']
+        if msgid == SET_NEXT_STEP_DIR_ID:
+            next_dir[oid] = params['dir']
+            continue
+        clock = last_clock.get(oid, 0)
+        interval = params['interval']
+        sdir = next_dir.get(oid, 0)
+        oid_steps = steps.setdefault(oid, [])
+        for i in range(params['count']):
+            clock += interval
+            oid_steps.append((clock, sdir))
+            interval += params['add']
+        last_clock[oid] = clock
+    return steps
+
+# Verify the batched step generation produces the same step times as
+# generating the steps one move at a time
+def check_steps(outfile, per_move_outfile, mcu_freq, max_error):
+    steps = decode_steps(outfile)
+    per_move_steps = decode_steps(per_move_outfile)
+    # Each step is within max_error of its ideal time in both outputs
+    max_diff = 2 * int(max_error * mcu_freq)
+    for oid in sorted(set(steps.keys() + per_move_steps.keys())):
+        oid_steps = steps.get(oid, [])
+        oid_per_move_steps = per_move_steps.get(oid, [])
+        if len(oid_steps) != len(oid_per_move_steps):
+            raise error("Stepper %d: %d steps batched vs %d per move" % (
+                oid, len(oid_steps), len(oid_per_move_steps)))
+        diff = 0
+        for (clock, sdir), (pm_clock, pm_sdir) in zip(oid_steps,
+                                                      oid_per_move_steps):
+            if sdir != pm_sdir:
+                raise error("Stepper %d: direction mismatch at clock %d" % (
+                    oid, clock))
+            diff = max(diff, abs(clock - pm_clock))
+        if diff > max_diff:
+            raise error("Stepper %d: step time differs by %d ticks" % (
+                oid, diff))
+        print "Stepper %d: %d steps match (max difference %d ticks)" % (
+            oid, len(oid_steps), diff)
+
+def open_output(fname):
+    if fname:
+        return open(fname, 'w+b')
+    return tempfile.TemporaryFile()
+
+def replay(info, records, outfile, options, per_move=False):
+    timer = StageTimer()
+    mcu = ReplayMCU(outfile, options)
+    th = ReplayToolHead(info, mcu, timer, options)
+    th.per_move = per_move
+    starttime = time.time()
+    th.replay(records)
+    total_time = time.time() - starttime
+    mcu.finish()
+    return th, timer, total_time
+
+def main():
+    usage = "%prog [options] <trace file>"
+    opts = optparse.OptionParser(usage)
+    opts.add_option("-f", "--freq", type="float", dest="mcu_freq",
+                    default=16000000., help="micro-controller clock rate")
+    opts.add_option("-e", "--max-error", type="float", dest="max_error",
+                    default=0.000025, help="max_stepper_error (in seconds)")
+    opts.add_option("-m", "--move-count", type="int", dest="move_count",
+                    default=500, help="micro-controller move queue size")
+    opts.add_option("-t", "--move-flush-time", type="float",
+                    dest="move_flush_time", default=0.050,
+                    help="toolhead move_flush_time (in seconds)")
+    opts.add_option("-o", "--output", type="string", dest="output",
+                    help="file to store the generated messages")
+    opts.add_option("-c", "--check", action="store_true", dest="check",
+                    help="compare batched and per-move step generation")
+    options, args = opts.parse_args()
+    if len(args) != 1:
+        opts.error("Incorrect number of arguments")
+    info, records = movetrace.read_trace(args[0])
+    outfile = open_output(options.output)
+    th, timer, total_time = replay(info, records, outfile, options)
+    queue_steps, steps = count_messages(outfile)
+    if options.check:
+        per_move_outfile = tempfile.TemporaryFile()
+        replay(info, records, per_move_outfile, options, per_move=True)
+        try:
+            check_steps(outfile, per_move_outfile,
+                        options.mcu_freq, options.max_error)
+        except error as e:
+            sys.stderr.write("Step check failed: %s\n" % (str(e),))
+            sys.exit(-1)
+        per_move_outfile.close()
+    outfile.close()
+    planner_time = total_time - timer.stepgen_time - timer.flush_time
+    def rate(count, runtime):
+        if runtime <= 0.:
+            return 0.
+        return count / runtime
+    print "Replayed %d records (%d moves, %.3fs of print time) in %.3fs" % (
+        len(records), th.moves, th.print_time, total_time)
+    print "  look-ahead:   %8.3fs  %12.0f moves/sec" % (
+        planner_time, rate(th.moves, planner_time))
+    print "  itersolve:    %8.3fs  %12.0f steps/sec" % (
+        timer.stepgen_time, rate(steps, timer.stepgen_time))
+    print "  stepcompress: %8.3fs  %12.0f queue_step msgs/sec" % (
+        timer.flush_time, rate(queue_steps, timer.flush_time))
+    print "  total:        %8.3fs  %12.0f moves/sec %.0f steps/sec" % (
+        total_time, rate(th.moves, total_time), rate(steps, total_time))
+    print "Generated %d steps in %d queue_step messages" % (
+        steps, queue_steps)
+
+if __name__ == '__main__':
+    main()
@@ -28,7 +28,7 @@ def main():
             so = steppers[args['oid']]
             so[0] += 1
             so[1] = args['dir']
-        elif parts[0] == 'queue_step':
+        elif parts[0] in ('queue_step', 'queue_step_delta'):
             so = steppers[args['oid']]
             so[2] += 1
             so[{'0': 3, '1': 4}[so[1]]] += int(args['count'])
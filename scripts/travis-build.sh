@@ -76,3 +76,10 @@ mkdir -p ${HOSTDIR}
 start_test klippy "Test invoke klippy"
 $PYTHON scripts/test_klippy.py -d ${DICTDIR} test/klippy/*.test
 finish_test klippy "Test invoke klippy"
+
+start_test replay "Test move trace replay"
+$PYTHON scripts/test_klippy.py -k -d ${DICTDIR} test/klippy/move_trace.test
+mv _test_output.trace ${HOSTDIR}/moves.trace
+rm -f _test_output _test_.log _test_.gcode
+$PYTHON scripts/replay_movetrace.py --check ${HOSTDIR}/moves.trace
+finish_test replay "Test move trace replay"
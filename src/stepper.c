@@ -43,6 +43,8 @@ struct stepper {
 #endif
     struct gpio_out step_pin, dir_pin;
     uint32_t position;
+    // Interval of the last step in the most recently queued sequence
+    uint32_t last_interval;
     struct stepper_move *first, **plast;
     uint32_t min_stop_interval;
     // gcc (pre v6) does better optimization when uint8_t are bitfields
@@ -171,18 +173,18 @@ stepper_oid_lookup(uint8_t oid)
 }
 
 // Schedule a set of steps with a given timing
-void
-command_queue_step(uint32_t *args)
+static void
+queue_step(struct stepper *s, uint32_t interval, uint16_t count, int16_t add)
 {
-    struct stepper *s = stepper_oid_lookup(args[0]);
-    struct stepper_move *m = move_alloc();
-    m->interval = args[1];
-    m->count = args[2];
-    if (!m->count)
+    if (!count)
         shutdown("Invalid count parameter");
-    m->add = args[3];
+    struct stepper_move *m = move_alloc();
+    m->interval = interval;
+    m->count = count;
+    m->add = add;
     m->next = NULL;
     m->flags = 0;
+    s->last_interval = interval + (uint32_t)add * (count - 1);
 
     irq_disable();
     uint8_t flags = s->flags;
@@ -208,9 +210,27 @@ command_queue_step(uint32_t *args)
     }
     irq_enable();
 }
+
+void
+command_queue_step(uint32_t *args)
+{
+    struct stepper *s = stepper_oid_lookup(args[0]);
+    queue_step(s, args[1], args[2], args[3]);
+}
 DECL_COMMAND(command_queue_step,
              "queue_step oid=%c interval=%u count=%hu add=%hi");
 
+// Schedule a set of steps with an interval relative to the interval
+// of the last step of the previously queued sequence
+void
+command_queue_step_delta(uint32_t *args)
+{
+    struct stepper *s = stepper_oid_lookup(args[0]);
+    queue_step(s, s->last_interval + args[1], args[2], args[3]);
+}
+DECL_COMMAND(command_queue_step_delta,
+             "queue_step_delta oid=%c interval_delta=%i count=%hu add=%hi");
+
 // Set the direction of the next queued step
 void
 command_set_next_step_dir(uint32_t *args)